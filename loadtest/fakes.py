@@ -0,0 +1,244 @@
+# loadtest/fakes.py
+"""
+Заглушки Bot API и ЮKassa для нагрузочного теста: локальные HTTP-серверы на aiohttp
+с настраиваемой задержкой ответа и долей ошибок.
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from aiohttp import web
+
+
+@dataclass
+class Faults:
+    """Задержка ответа latency_ms ± jitter, доля ответов 5xx и (для Bot API) 429"""
+    latency_ms: float = 0
+    jitter: float = 0.5
+    error_rate: float = 0
+    flood_rate: float = 0
+
+    async def delay(self) -> None:
+        if self.latency_ms > 0:
+            spread = self.latency_ms * self.jitter
+            await asyncio.sleep(max(0.0, random.uniform(self.latency_ms - spread, self.latency_ms + spread)) / 1000)
+
+
+@dataclass
+class SentMessage:
+    at: float
+    method: str
+    params: dict[str, Any]
+    message: dict[str, Any]
+
+
+async def _params(request: web.Request) -> dict[str, Any]:
+    """Параметры запроса PTB: JSON, form или multipart (файлы не нужны — только поля)"""
+    if request.content_type == "application/json":
+        return await request.json()
+    form = await request.post()
+    return {k: v for k, v in form.items() if isinstance(v, str)}
+
+
+class FakeBotApi:
+    """
+    Bot API: getUpdates с long polling из очереди, которую наполняет драйвер,
+    send*/copy*/forward* возвращают правдоподобный Message и складываются
+    в очередь сообщений чата — по ней драйвер ждёт ответа бота.
+    """
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+    def __init__(self, faults: Faults):
+        self.faults = faults
+        self.requests: dict[str, int] = defaultdict(int)
+        self.errors_injected = 0
+        self.polled = asyncio.Event()  # бот начал опрашивать getUpdates
+        self._updates: deque[dict] = deque()
+        self._update_id = 0
+        self._new_updates = asyncio.Event()
+        self._message_id = 0
+        self._chats: dict[int, asyncio.Queue[SentMessage]] = defaultdict(asyncio.Queue)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    # ---------- для драйвера ----------
+    def push_update(self, update: dict) -> None:
+        self._update_id += 1
+        self._updates.append({"update_id": self._update_id, **update})
+        self._new_updates.set()
+
+    def chat(self, chat_id: int) -> asyncio.Queue[SentMessage]:
+        return self._chats[chat_id]
+
+    # ---------- обработчики ----------
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        params = await _params(request)
+
+        if method == "getUpdates":
+            return _ok(await self._get_updates(params))
+        if method == "getMe":
+            return _ok(self.BOT_USER)
+
+        await self.faults.delay()
+        roll = random.random()
+        if roll < self.faults.flood_rate:
+            self.errors_injected += 1
+            return web.json_response(
+                {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                 "parameters": {"retry_after": 1}},
+                status=429,
+            )
+        if roll < self.faults.flood_rate + self.faults.error_rate:
+            self.errors_injected += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+
+        if method.startswith(("send", "copy", "forward")):
+            chat_id = int(params["chat_id"])
+            message = self._message(method, chat_id, params)
+            self._chats[chat_id].put_nowait(SentMessage(time.perf_counter(), method, params, message))
+            return _ok(message)
+        return _ok(True)
+
+    async def _get_updates(self, params: dict[str, Any]) -> list[dict]:
+        self.polled.set()
+        offset = int(params.get("offset") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        return [u for u in list(self._updates)[:limit] if u["update_id"] >= offset]
+
+    def _message(self, method: str, chat_id: int, params: dict[str, Any]) -> dict[str, Any]:
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self.BOT_USER,
+        }
+        file = {"file_id": f"file-{uuid.uuid4().hex}", "file_unique_id": uuid.uuid4().hex[:16]}
+        if method == "sendPhoto":
+            message["photo"] = [{**file, "width": 1280, "height": 720}]
+            message["caption"] = params.get("caption")
+        elif method == "sendVideoNote":
+            message["video_note"] = {**file, "length": 384, "duration": 10}
+        else:
+            message["text"] = params.get("text") or ""
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"]) if isinstance(params["reply_markup"], str) else params["reply_markup"]
+        return message
+
+
+class FakeYooKassa:
+    """API ЮKassa: создание и получение платежа; платежи хранятся в памяти"""
+
+    def __init__(self, faults: Faults):
+        self.faults = faults
+        self.requests = 0
+        self.errors_injected = 0
+        self.payments: dict[str, dict] = {}
+        self._by_idempotence_key: dict[str, str] = {}
+        # chat_id из metadata -> последний созданный платёж
+        self._by_chat: dict[int, str] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v3/payments", self._create)
+        app.router.add_get("/v3/payments/{payment_id}", self._get)
+        return app
+
+    def payment_for_chat(self, chat_id: int) -> Optional[dict]:
+        payment_id = self._by_chat.get(chat_id)
+        return self.payments.get(payment_id) if payment_id else None
+
+    async def _faulty(self) -> Optional[web.Response]:
+        self.requests += 1
+        await self.faults.delay()
+        if random.random() < self.faults.error_rate:
+            self.errors_injected += 1
+            return web.json_response({"type": "error", "code": "internal_server_error"}, status=500)
+        return None
+
+    async def _create(self, request: web.Request) -> web.Response:
+        error = await self._faulty()
+        if error:
+            return error
+        key = request.headers.get("Idempotence-Key", "")
+        if key in self._by_idempotence_key:
+            return web.json_response(self.payments[self._by_idempotence_key[key]])
+
+        body = await request.json()
+        payment_id = str(uuid.uuid4())
+        payment = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": body["amount"],
+            "description": body.get("description"),
+            "metadata": body.get("metadata") or {},
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://yoomoney.test/checkout/{payment_id}"},
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "test": True,
+        }
+        self.payments[payment_id] = payment
+        self._by_idempotence_key[key] = payment_id
+        chat_id = payment["metadata"].get("chat_id")
+        if chat_id is not None:
+            self._by_chat[int(chat_id)] = payment_id
+        return web.json_response(payment)
+
+    async def _get(self, request: web.Request) -> web.Response:
+        error = await self._faulty()
+        if error:
+            return error
+        payment = self.payments.get(request.match_info["payment_id"])
+        if payment is None:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        return web.json_response(payment)
+
+
+def succeeded_event(payment: dict) -> dict:
+    """Тело уведомления payment.succeeded, которое ЮKassa шлёт на вебхук"""
+    return {
+        "type": "notification",
+        "event": "payment.succeeded",
+        "object": {**payment, "status": "succeeded", "paid": True},
+    }
+
+
+def _ok(result: Any) -> web.Response:
+    return web.json_response({"ok": True, "result": result})
+
+
+@dataclass
+class RunningServer:
+    runner: web.AppRunner
+    url: str
+
+    async def close(self) -> None:
+        await self.runner.cleanup()
+
+
+async def serve(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> RunningServer:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return RunningServer(runner, f"http://{host}:{bound_port}")
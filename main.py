@@ -1,25 +1,45 @@
 import os
 import uuid
+import asyncio
 import logging
 from dotenv import load_dotenv
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
+from telegram.error import Forbidden, RetryAfter
 from telegram import WebAppInfo
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     ContextTypes, filters, JobQueue
 )
 
-from yookassa import Configuration, Payment
-
 # ==== наши модули (отдельные файлы) ====
 from db import get_session
+from models import Payment
 from services.subscriptions import (
-    get_or_create_user,
-    create_pending_payment,
+    upsert_user,
+    create_payment_intent,
+    set_provider_payment_id,
 )
 from services.n8n_service import n8n_service
+from services.media_assets import media_assets
+from services.yookassa_service import yookassa_service
+from services.tariff_catalog import tariff_catalog
+from services.update_processor import PerChatUpdateProcessor
+from services.telegram_rate_limiter import telegram_rate_limiter, Priority
+from services.sequences import MessageSequence, VideoNoteStep, PhotoStep, TextStep, sequence_runner, send_step
+from services.callback_router import CallbackRouter
+from services.reminders import schedule_payment_reminder, claim_due_reminders
+from services.outbox import outbox_relay, add_outbox_message, N8N_PAYMENT_CREATED_24H, N8N_PAYMENT_CREATED_48H
+from services.followups import claim_due_followups
+from services.subscription_expiry import expire_overdue_subscriptions
+from services.reports import refresh_daily_stats
+from services.funnel import funnel_recorder, funnel_step
+from services.metrics import metrics_server
+from services.tracing import tracer
+from services.traffic_capture import traffic_recorder
+from services.notification_service import send_followup_notification, notification_templates
+from screens import screens, get_community_text, monthly_price_text
 # Если webhook делаешь в отдельном сервисе, там же будут:
 #   mark_payment_succeeded, activate_or_extend_subscription
 
@@ -34,53 +54,83 @@ logger = logging.getLogger("bot")
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-# ЮKassa
-YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
-YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
+# ЮKassa (ключи магазина читает services/yookassa_service.py)
 RETURN_URL = os.getenv("RETURN_URL", "https://t.me/YourBotName")
 
+# Напоминания об оплате: как часто опрашивать таблицу и сколько строк брать за раз
+REMINDER_POLL_INTERVAL = int(os.getenv("REMINDER_POLL_INTERVAL", "15"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "200"))
+
+# Встроенные 24ч/48ч follow-up уведомления (вместо цепочки через N8N)
+FOLLOWUP_ENGINE_ENABLED = os.getenv("FOLLOWUP_ENGINE_ENABLED", "1") == "1"
+FOLLOWUP_POLL_INTERVAL = int(os.getenv("FOLLOWUP_POLL_INTERVAL", "60"))
+FOLLOWUP_BATCH_SIZE = int(os.getenv("FOLLOWUP_BATCH_SIZE", "500"))
+FOLLOWUP_SEND_CONCURRENCY = int(os.getenv("FOLLOWUP_SEND_CONCURRENCY", "20"))
+
+# Перевод просроченных подписок в expired: как часто, сколько строк за одну транзакцию
+# и слать ли пользователю сообщение «подписка закончилась»
+SUBSCRIPTION_SWEEP_INTERVAL = int(os.getenv("SUBSCRIPTION_SWEEP_INTERVAL", "600"))
+SUBSCRIPTION_SWEEP_BATCH_SIZE = int(os.getenv("SUBSCRIPTION_SWEEP_BATCH_SIZE", "1000"))
+SUBSCRIPTION_ENDED_MESSAGES = os.getenv("SUBSCRIPTION_ENDED_MESSAGES", "0") == "1"
+
+# Пересчёт дневных агрегатов для отчётов (reports.py --rollup); 0 — не пересчитывать
+REPORTS_REFRESH_INTERVAL = int(os.getenv("REPORTS_REFRESH_INTERVAL", "900"))
+REPORTS_REFRESH_DAYS = int(os.getenv("REPORTS_REFRESH_DAYS", "3"))
+
+# Адрес Bot API: свой Bot API server или заглушка нагрузочного теста (loadtest/)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+# Сколько обновлений обрабатывается одновременно (порядок внутри одного чата сохраняется)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "256"))
+
+# Хендлеры обрабатывают только сообщения и нажатия inline-кнопок — остальное Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Сообщения об оплате обгоняют в очереди на отправку ответы на кнопки и рассылки
+TRANSACTIONAL = {"priority": Priority.TRANSACTIONAL}
+
 # Видео файлы
 VIDEO_PATH = "content/doc_2025-08-15_19-37-12.mp4"  # квадратное видео
 
-# Настраиваем SDK ЮKassa
-Configuration.account_id = YOOKASSA_SHOP_ID
-Configuration.secret_key = YOOKASSA_SECRET_KEY
+WELCOME_TEXT = """Посмотри кружок и нажимай на кнопку снизу, чтобы узнать подробнее о MarketSkills: 👇🏻"""
+
+# /start: видео-кружок, через секунду — приветствие с кнопкой "Смотреть видео"
+START_SEQUENCE = MessageSequence("start", (
+    VideoNoteStep(VIDEO_PATH),
+    TextStep(
+        WELCOME_TEXT,
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Смотреть видео 📹", callback_data='watch_video')]]),
+        delay=1,
+    ),
+))
+
+# Описание комьюнити, через 3 секунды — кнопка подключения
+COMMUNITY_SEQUENCE = MessageSequence("community", (
+    PhotoStep("content/photo3.jpg", caption=get_community_text, parse_mode=ParseMode.HTML),
+    TextStep(
+        "🔥🔥🔥 ПОДКЛЮЧИТЬСЯ К КОМЬЮНИТИ 🔥🔥🔥",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💥 Подключиться 💥", callback_data='connect_community')]]),
+        delay=3,
+    ),
+))
 
 
-# ================== ХЕНДЛЕРЫ БОТА ==================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет приветственное сообщение при команде /start"""
     # Автоматически сохраняем или обновляем данные пользователя
     async with get_session() as session:
-        user = await get_or_create_user(
+        await upsert_user(
             session,
             tg_id=update.message.from_user.id,
             username=update.message.from_user.username,
             first_name=update.message.from_user.first_name
         )
         await session.commit()
+    funnel_recorder.record(update.message.from_user.id, "start")
 
-    # Сначала отправляем видео кружочек
-    try:
-        with open(VIDEO_PATH, "rb") as f:
-            await context.bot.send_video_note(
-                chat_id=update.message.chat.id,
-                video_note=f
-            )
-        # Добавляем небольшую задержку перед отправкой следующего сообщения
-        import asyncio
-        await asyncio.sleep(1)
-    except Exception as e:
-        logger.warning(f"Не удалось отправить видео кружочек: {e}")
-
-    # Затем отправляем приветственное сообщение с кнопкой
-    welcome_text = """Посмотри кружок и нажимай на кнопку снизу, чтобы узнать подробнее о MarketSkills: 👇🏻"""
-
-    # Создаем кнопку "Смотреть видео"
-    video_keyboard = [[InlineKeyboardButton("Смотреть видео 📹", callback_data='watch_video')]]
-    video_reply_markup = InlineKeyboardMarkup(video_keyboard)
-
-    await update.message.reply_text(welcome_text, reply_markup=video_reply_markup)
+    # Видео-кружок и приветствие отправляет планировщик последовательностей —
+    # хендлер не ждёт паузу между сообщениями
+    sequence_runner.schedule(update.message.chat.id, START_SEQUENCE)
 
     # Таймер отключен - сообщение о комьюнити будет отправляться только при нажатии кнопки
     # chat_id = update.message.chat.id
@@ -99,75 +149,99 @@ async def send_community_message(context: ContextTypes.DEFAULT_TYPE) -> None:
         if job_to_cancel != job:  # не отменяем текущий job
             job_to_cancel.schedule_removal()
 
-    community_text = """<b>Открываю тебе доступ в закрытое комьюнити, но знай что...</b> 
+    sequence_runner.schedule(chat_id, COMMUNITY_SEQUENCE)
 
-Здесь, люди зарабатывают онлайн, позабыв о "работы ради работы" 
 
-📦 Здесь заходят в маркетплейсы с 0
-даже без товаров — и вот почему:
-
-💥 Каждые 2 недели — разборы направлений, кейсы с реальными результатами и эфиры 
+async def poll_payment_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Периодически забирает из таблицы payment_reminders наступившие напоминания
+    пачками и отправляет их. Напоминания переживают рестарт и деплой бота.
+    """
+    while True:
+        async with get_session() as session:
+            claimed, due = await claim_due_reminders(session, limit=REMINDER_BATCH_SIZE)
+            await session.commit()
 
-🫂 Чат с поддержкой: можешь задать вопрос по проекту, сделке, карточке или запуску — подскажут, как сделать лучше.
+        if due:
+            results = await asyncio.gather(
+                *(send_payment_reminder(context.bot, chat_id, payment_id) for payment_id, chat_id in due),
+                return_exceptions=True,
+            )
+            for (payment_id, chat_id), result in zip(due, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"Не удалось отправить напоминание по платежу {payment_id} в чат {chat_id}: {result}")
 
-📚 Пошаговые уроки: как стать менеджером маркетплейсов и всё 
-это без "курсов за 100к".
+        # Забрана неполная пачка — очередь разобрана до конца; оплаченные платежи
+        # в полной пачке (due короче claimed) разбор не останавливают
+        if claimed < REMINDER_BATCH_SIZE:
+            return
 
-🤝 Ты не просто подписчик — ты часть команды. Здесь находят клиентов, запускают свои первые проекты 
 
-А ещё — тут по-настоящему тёплая движуха. Вместе шутим про поставщиков, скидываем факапы, обсуждаем маркетплейсные тренды и помогаем друг другу не сгореть.
+async def run_followups(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Движок 24ч/48ч уведомлений: выбирает из users пачку неоплативших пользователей,
+    у которых подошёл срок, помечает флаги и рассылает сообщения.
+    48ч обрабатываем первыми — они заодно закрывают просроченные 24ч.
+    """
+    for notification_type in ("48h", "24h"):
+        while True:
+            async with get_session() as session:
+                due = await claim_due_followups(session, notification_type, limit=FOLLOWUP_BATCH_SIZE)
+                await session.commit()
+
+            for i in range(0, len(due), FOLLOWUP_SEND_CONCURRENCY):
+                chunk = due[i:i + FOLLOWUP_SEND_CONCURRENCY]
+                results = await asyncio.gather(
+                    *(send_followup_notification(context.bot, telegram_id, notification_type) for _, telegram_id in chunk),
+                    return_exceptions=True,
+                )
+                for (user_id, telegram_id), result in zip(chunk, results):
+                    if isinstance(result, Forbidden):
+                        logger.info(f"User {telegram_id} blocked the bot, skipping {notification_type} notification")
+                    elif isinstance(result, Exception):
+                        logger.warning(f"Не удалось отправить {notification_type} уведомление пользователю {telegram_id}: {result}")
 
-И всё это — за 1490₽ в месяц.
-Когда, если не сейчас. Вступай!"""
+            if due:
+                logger.info(f"Отправлено {notification_type} уведомлений: {len(due)}")
+            if len(due) < FOLLOWUP_BATCH_SIZE:
+                break
 
-    photo_path = "content/photo3.jpg"
 
-    try:
-        with open(photo_path, 'rb') as photo:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=community_text,
-                parse_mode=ParseMode.HTML
+async def expire_subscriptions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Переводит просроченные подписки в expired пачками по SUBSCRIPTION_SWEEP_BATCH_SIZE:
+    каждая пачка — отдельная короткая транзакция, а не один UPDATE на всю таблицу.
+    """
+    total_expired = total_notified = 0
+    while True:
+        async with get_session() as session:
+            expired, notified = await expire_overdue_subscriptions(
+                session,
+                limit=SUBSCRIPTION_SWEEP_BATCH_SIZE,
+                notify=SUBSCRIPTION_ENDED_MESSAGES,
             )
-    except Exception as e:
-        logger.warning(f"Не удалось отправить фото комьюнити: {e}")
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=community_text,
-            parse_mode=ParseMode.HTML
-        )
+            await session.commit()
+        total_expired += expired
+        total_notified += notified
+        if expired < SUBSCRIPTION_SWEEP_BATCH_SIZE:
+            break
 
-    # Запуск таймера на 3 секунды для отправки кнопки подключения к комьюнити
-    import asyncio
-    await asyncio.sleep(3)
+    if total_expired:
+        logger.info(f"Подписок переведено в expired: {total_expired}, сообщений об окончании в очереди: {total_notified}")
+    if total_notified:
+        outbox_relay.notify()
 
-    # Отправляем текст и кнопку подключения к комьюнити
-    connect_keyboard = [[InlineKeyboardButton("💥 Подключиться 💥", callback_data='connect_community')]]
-    connect_reply_markup = InlineKeyboardMarkup(connect_keyboard)
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="🔥🔥🔥 ПОДКЛЮЧИТЬСЯ К КОМЬЮНИТИ 🔥🔥🔥",
-        reply_markup=connect_reply_markup
-    )
+async def refresh_report_stats(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пересчитывает daily_payment_stats за последние REPORTS_REFRESH_DAYS дней"""
+    async with get_session() as session:
+        rows = await refresh_daily_stats(session, days=REPORTS_REFRESH_DAYS)
+        await session.commit()
+    logger.debug(f"daily_payment_stats: обновлено строк {rows}")
 
 
-async def send_payment_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
+async def send_payment_reminder(bot, chat_id: int, payment_id: int) -> None:
     """Отправляет напоминание об оплате через 15 минут после создания ссылки"""
-    job = context.job
-    payment_id = job.data.get('payment_id')
-    chat_id = job.chat_id
-    
-    # Проверяем статус платежа перед отправкой напоминания
-    async with get_session() as session:
-        from models import Payment, PaymentStatus
-        payment = await session.get(Payment, payment_id)
-        
-        # Если платеж уже оплачен, не отправляем напоминание
-        if not payment or payment.status == PaymentStatus.succeeded:
-            return
-    
     # Текст сообщения
     reminder_text = """*Что-то не так с оплатой…* 😞
 Оплата не поступила, нажми на кнопку *'Перейти к оплате'* для того чтобы не откладывать дело на потом
@@ -185,69 +259,25 @@ async def send_payment_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
     photo_path = "content/photo4.jpg"
     
     try:
-        with open(photo_path, 'rb') as photo:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=reminder_text,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=reminder_reply_markup
-            )
+        await media_assets.send_photo(
+            bot,
+            chat_id,
+            photo_path,
+            caption=reminder_text,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reminder_reply_markup,
+            rate_limit_args=TRANSACTIONAL,
+        )
+    except (Forbidden, RetryAfter):
+        raise
     except Exception as e:
         logger.warning(f"Не удалось отправить фото напоминания: {e}")
-        await context.bot.send_message(
+        await bot.send_message(
             chat_id=chat_id,
             text=reminder_text,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reminder_reply_markup
-        )
-
-
-async def send_community_message_direct(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Прямая отправка сообщения с описанием комьюнити (при нажатии кнопки)"""
-    community_text = """<b>Открываю тебе доступ в закрытое комьюнити, но знай что...</b> 
-
-Здесь, люди зарабатывают онлайн, позабыв о "работы ради работы" 
-
-📦 Здесь заходят в маркетплейсы с 0
-даже без товаров — и вот почему:
-
-💥 Каждые 2 недели — разборы направлений, кейсы с реальными результатами и эфиры 
-
-🫂 Чат с поддержкой: можешь задать вопрос по проекту, сделке, карточке или запуску — подскажут, как сделать лучше.
-
-📚 Пошаговые уроки: как стать менеджером маркетплейсов и всё 
-это без "курсов за 100к".
-
-🤝 Ты не просто подписчик — ты часть команды. Здесь находят клиентов, запускают свои первые проекты 
-
-А ещё — тут по-настоящему тёплая движуха. Вместе шутим про поставщиков, скидываем факапы, обсуждаем маркетплейсные тренды и помогаем друг другу не сгореть.
-
-И всё это — за 1490₽ в месяц.
-Когда, если не сейчас. Вступай!"""
-
-    photo_path = "content/photo3.jpg"
-
-    # Создаем кнопку подключения к комьюнити
-    connect_keyboard = [[InlineKeyboardButton("💥 Подключиться 💥", callback_data='connect_community')]]
-    connect_reply_markup = InlineKeyboardMarkup(connect_keyboard)
-
-    try:
-        with open(photo_path, 'rb') as photo:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=community_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=connect_reply_markup
-            )
-    except Exception as e:
-        logger.warning(f"Не удалось отправить фото комьюнити: {e}")
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=community_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=connect_reply_markup
+            reply_markup=reminder_reply_markup,
+            rate_limit_args=TRANSACTIONAL,
         )
 
 
@@ -262,11 +292,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
 async def services_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    services_text = """Описание услуги: 
+    services_text = f"""Описание услуги: 
 
 Мы создали целое сообщество, подписочный проект, который позволяет людям обучиться и работать в сфере маркетплейсов и товарного бизнеса 
 
-За подписку в 1490₽
+За подписку в {monthly_price_text()}
 Человек получает:
 
 - Уроки по тому, как стать менеджером маркетплейсов
@@ -292,7 +322,7 @@ async def send_message_series(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 # --------- ЮKassa: создание платежа ---------
-def yk_create_payment_and_get_url(chat_id: int, payment_db_id: int, tariff_code: str, amount_rub: str, description: str):
+async def yk_create_payment_and_get_url(chat_id: int, payment_db_id: int, tariff_code: str, amount_rub: str, description: str):
     """
     Создаёт платёж в ЮKassa и возвращает (provider_payment_id, confirmation_url).
     amount_rub: строка с двумя знаками, например '1490.00'
@@ -303,7 +333,11 @@ def yk_create_payment_and_get_url(chat_id: int, payment_db_id: int, tariff_code:
         "tariff": tariff_code,
         "payment_db_id": payment_db_id
     }
-    payment = Payment.create({
+    # ЮKassa вернёт metadata в вебхуке — по trace_id шаги оплаты собираются в одну трассу
+    trace_id = tracer.current_trace_id()
+    if trace_id:
+        metadata["trace_id"] = trace_id
+    payment = await yookassa_service.create_payment({
         "amount": {"value": amount_rub, "currency": "RUB"},
         "confirmation": {"type": "redirect", "return_url": RETURN_URL},
         "capture": True,
@@ -322,342 +356,222 @@ def yk_create_payment_and_get_url(chat_id: int, payment_db_id: int, tariff_code:
             }]
         }
     }, idempotence_key)
-    return payment.id, payment.confirmation.confirmation_url
-
-
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик нажатий на inline кнопки"""
-    query = update.callback_query
-    await query.answer()
-
-    if query.data == 'all_good_continue':
-        # Обработчик для кнопки "Все супер, дальше🚀"
-        # Отправляем сообщение о комьюнити
-        await send_community_message_direct(query.message.chat.id, context)
-
-    elif query.data == 'watch_video':
-        # Обработчик для кнопки "Смотреть видео 📹"
-        # Отправляем картинку с двумя кнопками
-        button_keyboard = [
-            [InlineKeyboardButton("Смотреть инструкцию 👀", url="https://disk.yandex.ru/d/4UDQVRfIjnfUSw")],
-            [InlineKeyboardButton("Все супер, дальше🚀", callback_data='all_good_continue')]
-        ]
-        button_reply_markup = InlineKeyboardMarkup(button_keyboard)
-
-        button_photo_path = "content/3810.JPG"
-
-        try:
-            with open(button_photo_path, 'rb') as photo:
-                await query.message.reply_photo(
-                    photo=photo,
-                    reply_markup=button_reply_markup
-                )
-        except Exception as e:
-            logger.warning(f"Не удалось отправить фото с кнопками: {e}")
-            await query.message.reply_text("Выберите действие:", reply_markup=button_reply_markup)
-
-    elif query.data == 'connect_community':
-        # Обработчик для кнопки "💥Подключиться к комьюнити"
-        tariff_text = """Выбирай подходящий тариф! 👌🏻
-
-Помесячный - 1490₽/мес. 
-Стабильный - 3990₽/ 3 мес. 
-
-По всем вопросам: оплаты или просто так, пишите сюда :)
-@spoddershka"""
-
-        photo_path = "content/photo2.jpg"
-
-        # Создаем кнопку "Выбрать тариф"
-        choose_tariff_keyboard = [[InlineKeyboardButton("🤝 Выбрать тариф 🤝", callback_data='choose_tariff_step')]]
-        choose_tariff_reply_markup = InlineKeyboardMarkup(choose_tariff_keyboard)
-
-        try:
-            with open(photo_path, 'rb') as photo:
-                await query.message.reply_photo(
-                    photo=photo,
-                    caption=tariff_text,
-                    reply_markup=choose_tariff_reply_markup
-                )
-        except Exception as e:
-            logger.warning(f"Не удалось отправить фото с тарифами: {e}")
-            await query.message.reply_text(tariff_text, reply_markup=choose_tariff_reply_markup)
-
-    elif query.data == 'choose_tariff_step':
-        # Обработчик для кнопки "🤝Выбрать тариф"
-        oferta_url = "https://docs.yandex.ru/docs/view?url=ya-disk-public%3A%2F%2FZkx7HkIuQDpkVUiXOfvHBOO%2FQPNC9%2Fxb%2BiOzOS22ub%2FpW7TeWe4Yk3b3NEtMKypTq%2FJ6bpmRyOJonT3VoXnDag%3D%3D"
-
-        oferta_text = f"""<b>Ты уже в шаге от нас!</b> 🥹
-Перед тем как тебя перенаправит на оплату, нажимая на кнопку: <b>"Далее"</b> ты соглашаешься с <a href="{oferta_url}">Публичной офферты</a>"""
-
-        dalee_keyboard = [[InlineKeyboardButton("Далее", callback_data='proceed_to_payment')]]
-        dalee_reply_markup = InlineKeyboardMarkup(dalee_keyboard)
-
-        await query.message.reply_text(
-            text=oferta_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=dalee_reply_markup,
-            disable_web_page_preview=True
-        )
-
-    elif query.data == 'proceed_to_payment':
-        # Обработчик для кнопки "Далее"
-        payment_keyboard = [
-            [InlineKeyboardButton("Оплата картой РФ 🇷🇺", callback_data='payment_rf_card')],
-            [InlineKeyboardButton("Оплата не РФ 🌍", callback_data='payment_foreign_card')]
-        ]
-        payment_reply_markup = InlineKeyboardMarkup(payment_keyboard)
-
-        await query.message.reply_text(
-            text="<b>Выберите способ оплаты</b> 💳:",
-            parse_mode=ParseMode.HTML,
-            reply_markup=payment_reply_markup
-        )
-
-    elif query.data == 'payment_foreign_card':
-        # Обработчик для кнопки "Оплата картой иностранного банка"
-        foreign_payment_keyboard = [[InlineKeyboardButton("💳 Перейти к оплате", url="https://t.me/tribute/app?startapp=ep_8xY0SyWiII0m5WAIvnXUKtqnazJqBXJjWYaks9qLwjy6iK7m80")]]
-        foreign_payment_reply_markup = InlineKeyboardMarkup(foreign_payment_keyboard)
-
-        await query.message.reply_text(
-            text="Для оплаты картой иностранного банка нажмите кнопку ниже:",
-            reply_markup=foreign_payment_reply_markup
-        )
+    return payment["id"], payment["confirmation"]["confirmation_url"]
 
-    elif query.data == 'payment_rf_card':
-        # Обработчик для кнопки "Оплата картой РФ" - показываем выбор тарифов
-        tariff_keyboard = [
-            [InlineKeyboardButton("Тариф Помесячный — 1490₽/мес.", callback_data='tariff_monthly')],
-            [InlineKeyboardButton("Тариф Стабильный — 3990₽ / 3 мес.", callback_data='tariff_stable')],
-        ]
-        await query.message.reply_text(
-            "Выберите тариф 👇",
-            reply_markup=InlineKeyboardMarkup(tariff_keyboard),
-        )
 
-    elif query.data == 'learn_more':
-        oferta_url = (
-            "https://docs.yandex.ru/docs/view?url=ya-disk-public%3A%2F%2FZkx7HkIuQDpkVUiXOfvHBOO%2FQPNC9%2Fxb%2BiOzOS22ub%2FpW7TeWe4Yk3b3NEtMKypTq%2FJ6bpmRyOJonT3VoXnDag%3D%3D"
-            "&name=%D0%9E%D1%84%D1%84%D0%B5%D1%80%D1%82%D0%B0%20MarketSkills%20(2).docx&nosw=1"
-        )
+# ================== КНОПКИ ==================
+router = CallbackRouter()
 
-        keyboard = [
-            [InlineKeyboardButton("Посмотреть оферту 📄", url=oferta_url)],
-            [InlineKeyboardButton("ДАЛЕЕ", callback_data='next_step')],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+# callback_data -> заранее собранный экран (screens.py)
+SCREEN_ROUTES = {
+    'all_good_continue': "community",               # "Все супер, дальше🚀"
+    'watch_video': "video_instructions",            # "Смотреть видео 📹"
+    'connect_community': "tariffs_overview",        # "💥Подключиться к комьюнити"
+    'choose_tariff_step': "oferta",                 # "🤝Выбрать тариф"
+    'proceed_to_payment': "payment_methods",        # "Далее"
+    'payment_foreign_card': "foreign_payment",      # "Оплата картой иностранного банка"
+    'payment_rf_card': "tariff_choice",             # "Оплата картой РФ" - выбор тарифов
+    'learn_more': "learn_more",
+    'next_step': "tariffs_overview_next",
+    'choose_tariff': "tariff_choice_back",
+    'contact_support': "support",                   # "Помощник"
+    # "Подключиться" из уведомлений 24ч и 48ч — сразу к выбору способа оплаты
+    'notification_24h_connect': "payment_methods",
+    'notification_48h_connect': "payment_methods",
+}
 
-        oferta_text = (
-            'Нажимая "Далее" вы соглашаетесь с условиями публичной '
-            f'<a href="{oferta_url}">ОФФЕРТЫ</a> 📄'
-            '\nинн: 051701385730 ИП Газиев Шамиль Газиевич'
-        )
 
-        await query.message.reply_text(
-            text=oferta_text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML,
-            disable_web_page_preview=True,
-        )
+def _screen_handler(screen_name: str):
+    async def show_screen(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await send_step(context.bot, update.callback_query.message.chat.id, screens.get(screen_name))
+    return show_screen
 
-    elif query.data == 'next_step':
-        keyboard = [[InlineKeyboardButton("Выбрать тариф 🚀", callback_data='choose_tariff')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
 
-        tariff_text = """Выбирай подходящий тариф! 👌🏻
+for _data, _screen_name in SCREEN_ROUTES.items():
+    router.exact(_data)(_screen_handler(_screen_name))
 
-Помесячный - 1490₽/мес. 
-Стабильный - 3990₽/ 3 мес. 
 
-По всем вопросам: оплаты или просто так, пишите сюда :)
-@spoddershka"""
-        photo_path = "content/photo2.jpg"
+@router.prefix('tariff_')
+async def handle_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE, tariff_code: str) -> None:
+    """Кнопка тарифа: создаём платёж и отдаём ссылку на оплату в ЮKassa"""
+    query = update.callback_query
+    tariff = tariff_catalog.get(tariff_code)
+    if tariff is None:
+        logger.warning(f"Неизвестный тариф в callback_data: {query.data}")
+        return
 
-        try:
-            with open(photo_path, 'rb') as photo:
-                await query.message.reply_photo(
-                    photo=photo,
-                    caption=tariff_text,
-                    reply_markup=reply_markup
-                )
-        except Exception as e:
-            logging.warning(f"Не удалось отправить фото: {e}")
-            await query.message.reply_text(tariff_text, reply_markup=reply_markup)
-
-    # ---------- ДОБАВЛЕННЫЕ ОБРАБОТЧИКИ КНОПОК ТАРИФОВ ----------
-    elif query.data == 'choose_tariff':
-        tariff_keyboard = [
-            [InlineKeyboardButton("Тариф Помесячный — 1490₽/мес.", callback_data='tariff_monthly')],
-            [InlineKeyboardButton("Тариф Стабильный — 3990₽ / 3 мес.", callback_data='tariff_stable')],
-            [InlineKeyboardButton("↩️ Назад", callback_data='next_step')],
-        ]
-        await query.message.reply_text(
-            "Выберите тариф 👇",
-            reply_markup=InlineKeyboardMarkup(tariff_keyboard),
-        )
+    # trace_id уходит в metadata платежа и связывает клик с вебхуком и обработкой оплаты
+    with tracer.trace("tariff_click", tariff=tariff_code):
+        await create_tariff_payment(query, tariff, tariff_code)
 
-    elif query.data in ('tariff_monthly', 'tariff_stable'):
-        tariff_code = 'monthly' if query.data == 'tariff_monthly' else 'stable'
 
-        # 1) фиксируем намерение оплаты в БД (pending)
+async def create_tariff_payment(query, tariff, tariff_code: str) -> None:
+    # 1) фиксируем намерение оплаты в БД (pending): upsert пользователя + платёж одним запросом
+    with tracer.span("create_payment_intent"):
         async with get_session() as session:
-            user = await get_or_create_user(
+            payment = await create_payment_intent(
                 session,
                 tg_id=query.from_user.id,
                 username=query.from_user.username,
-                first_name=query.from_user.first_name
+                first_name=query.from_user.first_name,
+                tariff_code=tariff_code,
             )
-            payment = await create_pending_payment(session, user.id, tariff_code=tariff_code)
-            await session.commit()  # чтобы получить payment.id
+            await session.commit()
 
-        # 2) создаём платёж в ЮKassa и сохраняем provider_payment_id
-        try:
-            amount_str = f"{float(payment.amount_rub):.2f}"
-            description = (
-                "Подписка MARKETSKILLS — Помесячный (1 мес.)"
-                if tariff_code == "monthly"
-                else "Подписка MARKETSKILLS — Стабильный (3 мес.)"
-            )
-            provider_payment_id, url = yk_create_payment_and_get_url(
+    # 2) создаём платёж в ЮKassa и сохраняем provider_payment_id
+    try:
+        description = tariff.description
+        with tracer.span("yk_create_payment_and_get_url"):
+            provider_payment_id, url = await yk_create_payment_and_get_url(
                 chat_id=query.from_user.id,
                 payment_db_id=payment.id,
                 tariff_code=tariff_code,
-                amount_rub=amount_str,
+                amount_rub=tariff.amount_str,
                 description=description,
             )
-            # сохраняем provider_payment_id
+        # сохраняем provider_payment_id (точечный UPDATE)
+        with tracer.span("set_provider_payment_id"):
             async with get_session() as session:
-                # лёгкое обновление — заново подгружать объект не обязательно,
-                # но для простоты можно так:
-                from sqlalchemy import select
-                from models import Payment as PaymentModel
-                p = await session.get(PaymentModel, payment.id)
-                if p:
-                    p.provider_payment_id = provider_payment_id
-                    await session.commit()
-
-            title = "*Тариф Помесячный* — 1490₽/мес." if tariff_code == "monthly" \
-                else "*Тариф Стабильный* — 3990₽ / 3 мес."
-            
-            # Запускаем таймер на 15 минут для напоминания об оплате
-            if context.job_queue:
-                context.job_queue.run_once(
-                    send_payment_reminder, 
-                    900,  # 15 минут в секундах
-                    chat_id=query.from_user.id, 
-                    name=f"payment_reminder_{payment.id}",
-                    data={'payment_id': payment.id}
-                )
-            
-            # Отправляем данные в N8N для 24-часового уведомления
-            try:
-                await n8n_service.send_payment_created_notification(
-                    user_id=user.id,
-                    payment_id=payment.id,
-                    chat_id=query.from_user.id,
-                    tariff_code=tariff_code,
-                    amount_rub=float(payment.amount_rub),
-                    provider_payment_id=provider_payment_id,
-                    payment_url=url
-                )
-                
-                # Также отправляем для 48-часового уведомления  
-                await n8n_service.send_48h_payment_created_notification(
-                    user_id=user.id,
-                    payment_id=payment.id,
-                    chat_id=query.from_user.id,
-                    tariff_code=tariff_code,
-                    amount_rub=float(payment.amount_rub),
-                    provider_payment_id=provider_payment_id,
-                    payment_url=url
-                )
-            except Exception as e:
-                logger.warning(f"Ошибка отправки уведомления в N8N: {e}")
-            
-            await query.message.reply_text(
-                f"✅ Вы выбрали {title}\n"
-                f"Заявка на оплату №{payment.id} создана.\n"
-                "Нажмите кнопку ниже, чтобы перейти к оплате:",
+                await set_provider_payment_id(session, payment.id, provider_payment_id)
+                # Напоминание через 15 минут — строкой в БД, чтобы пережить рестарт бота
+                await schedule_payment_reminder(session, payment.id, query.from_user.id)
+                # События для 24- и 48-часового уведомления в N8N (если не включён встроенный
+                # движок follow-up) — через outbox той же транзакцией, отправит outbox_relay
+                if not FOLLOWUP_ENGINE_ENABLED:
+                    n8n_payload = dict(
+                        user_id=payment.user_id,
+                        payment_id=payment.id,
+                        chat_id=query.from_user.id,
+                        tariff_code=tariff_code,
+                        amount_rub=payment.amount_rub,
+                        provider_payment_id=provider_payment_id,
+                        payment_url=url,
+                    )
+                    add_outbox_message(session, N8N_PAYMENT_CREATED_24H, n8n_payload)
+                    add_outbox_message(session, N8N_PAYMENT_CREATED_48H, n8n_payload)
+                await session.commit()
+        if not FOLLOWUP_ENGINE_ENABLED:
+            outbox_relay.notify()
+
+        title = f"*Тариф {tariff.title}* — {tariff.period_text}"
+
+        with tracer.span("reply_payment_link"):
+            # через бота, а не Message.reply_text: только send_message принимает rate_limit_args
+            await query.get_bot().send_message(
+                chat_id=query.message.chat_id,
+                text=f"✅ Вы выбрали {title}\n"
+                     f"Заявка на оплату №{payment.id} создана.\n"
+                     "Нажмите кнопку ниже, чтобы перейти к оплате:",
                 parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💳 Оплатить в ЮKassa", url=url)]])
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💳 Оплатить в ЮKassa", url=url)]]),
+                rate_limit_args=TRANSACTIONAL,
             )
-        except Exception:
-            logger.exception("Ошибка создания платежа в ЮKassa")
-            await query.message.reply_text("❌ Не удалось создать платёж. Попробуйте позже.")
-
-    elif query.data.startswith('retry_payment_'):
-        # Обработчик для кнопки "Перейти к оплате" из напоминания
-        payment_id = int(query.data.split('_')[2])
-        
-        async with get_session() as session:
-            from models import Payment
-            payment = await session.get(Payment, payment_id)
-            
-            if payment and payment.provider_payment_id:
-                # Получаем информацию о платеже из ЮKassa
-                from yookassa import Payment as YKPayment
-                try:
-                    yk_payment = YKPayment.find_one(payment.provider_payment_id)
-                    if yk_payment and yk_payment.confirmation and yk_payment.confirmation.confirmation_url:
-                        await query.message.reply_text(
-                            f"💳 Перейдите по ссылке для завершения оплаты №{payment.id}:",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("💳 Оплатить в ЮKassa", url=yk_payment.confirmation.confirmation_url)
-                            ]])
-                        )
-                    else:
-                        await query.message.reply_text("❌ Ссылка на оплату недоступна. Обратитесь в поддержку.")
-                except Exception as e:
-                    logger.error(f"Ошибка получения данных платежа из ЮKassa: {e}")
-                    await query.message.reply_text("❌ Ошибка получения ссылки на оплату. Попробуйте позже.")
+    except Exception:
+        logger.exception(f"Ошибка создания платежа в ЮKassa (trace_id={tracer.current_trace_id()})")
+        await query.message.reply_text("❌ Не удалось создать платёж. Попробуйте позже.")
+
+
+@router.prefix('retry_payment_')
+async def handle_retry_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, payment_id: str) -> None:
+    """Кнопка "Перейти к оплате" из напоминания"""
+    query = update.callback_query
+    if not payment_id.isdigit():
+        logger.warning(f"Некорректный id платежа в callback_data: {query.data}")
+        return
+
+    async with get_session() as session:
+        payment = await session.get(Payment, int(payment_id))
+
+    if payment and payment.provider_payment_id:
+        # Получаем информацию о платеже из ЮKassa
+        try:
+            yk_payment = await yookassa_service.find_payment(payment.provider_payment_id)
+            confirmation_url = (yk_payment.get("confirmation") or {}).get("confirmation_url")
+            if confirmation_url:
+                await query.message.reply_text(
+                    f"💳 Перейдите по ссылке для завершения оплаты №{payment.id}:",
+                    reply_markup=InlineKeyboardMarkup([[
+                        InlineKeyboardButton("💳 Оплатить в ЮKassa", url=confirmation_url)
+                    ]])
+                )
             else:
-                await query.message.reply_text("❌ Платеж не найден или ссылка недоступна.")
+                await query.message.reply_text("❌ Ссылка на оплату недоступна. Обратитесь в поддержку.")
+        except Exception as e:
+            logger.error(f"Ошибка получения данных платежа из ЮKassa: {e}")
+            await query.message.reply_text("❌ Ошибка получения ссылки на оплату. Попробуйте позже.")
+    else:
+        await query.message.reply_text("❌ Платеж не найден или ссылка недоступна.")
 
-    elif query.data == 'contact_support':
-        # Обработчик для кнопки "Помощник"
-        support_text = """🆘 <b>Поддержка MarketSkills</b>
 
-По всем вопросам оплаты или работы с платформой обращайтесь к:
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик нажатий на inline кнопки: маршрут ищется по таблице router"""
+    query = update.callback_query
+    await query.answer()
 
-👤 @spoddershka
+    step, detail = funnel_step(query.data or "")
+    if step:
+        funnel_recorder.record(query.from_user.id, step, detail)
 
-Он поможет решить любые вопросы и проблемы! 😊"""
-        
-        await query.message.reply_text(
-            text=support_text,
-            parse_mode=ParseMode.HTML
-        )
+    # Пользователь пошёл дальше по кнопке — оставшиеся сообщения последовательностей не нужны
+    sequence_runner.cancel(query.message.chat.id)
 
-    elif query.data in ('notification_24h_connect', 'notification_48h_connect'):
-        # Обработчик для кнопки "Подключиться" из уведомлений 24ч и 48ч
-        # Переадресуем на существующий обработчик выбора способа оплаты
-        payment_keyboard = [
-            [InlineKeyboardButton("Оплата картой РФ 🇷🇺", callback_data='payment_rf_card')],
-            [InlineKeyboardButton("Оплата не РФ 🌍", callback_data='payment_foreign_card')]
-        ]
-        payment_reply_markup = InlineKeyboardMarkup(payment_keyboard)
-
-        await query.message.reply_text(
-            text="<b>Выберите способ оплаты</b> 💳:",
-            parse_mode=ParseMode.HTML,
-            reply_markup=payment_reply_markup
-        )
-    # ------------------------------------------------------------
+    if not await router.dispatch(update, context):
+        logger.warning(f"Нет обработчика для callback_data: {query.data}")
 
 
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(f"Вы написали: {update.message.text}")
 
 
-def main() -> None:
-    """Запуск бота (без вебхуков ЮKassa — они в отдельном сервисе)"""
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN не найден в переменных окружения!")
-        return
-
+async def post_init(application: Application) -> None:
+    """Открываем долгоживущие HTTP-клиенты вместе с приложением"""
+    await tariff_catalog.start()
+    # экраны собираем сразу после загрузки тарифов, а не на первом нажатии
+    screens.build()
+    notification_templates.load()
+    await sequence_runner.start(application.bot)
+    await yookassa_service.start()
+    await n8n_service.start()
+    # сообщения из outbox (события в N8N, уведомления об оплате) отправляет любой из процессов
+    await outbox_relay.start(application.bot)
+    await funnel_recorder.start()
+    # /metrics для режима polling; в webhook.py метрики отдаёт FastAPI
+    await metrics_server.start()
+    await tracer.start("bot")
+    await traffic_recorder.start()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Закрываем HTTP-клиенты при остановке бота"""
+    await tariff_catalog.close()
+    await sequence_runner.close()
+    await yookassa_service.close()
+    await outbox_relay.close()
+    await n8n_service.close()
+    await funnel_recorder.close()
+    await metrics_server.close()
+    await traffic_recorder.close()
+    await tracer.close()
+
+
+def build_application() -> Application:
+    """
+    Собирает Application со всеми хендлерами и фоновыми задачами.
+    Используется и для polling (main), и для приёма обновлений через вебхук (webhook.py).
+    """
     # Создаем приложение с Job Queue
     job_queue = JobQueue()
-    application = Application.builder().token(BOT_TOKEN).job_queue(job_queue).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_BASE_URL)
+        .job_queue(job_queue)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .rate_limiter(telegram_rate_limiter)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -666,7 +580,47 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.job_queue.run_repeating(
+        poll_payment_reminders,
+        interval=REMINDER_POLL_INTERVAL,
+        first=REMINDER_POLL_INTERVAL,
+        name="payment_reminders",
+    )
+    if FOLLOWUP_ENGINE_ENABLED:
+        application.job_queue.run_repeating(
+            run_followups,
+            interval=FOLLOWUP_POLL_INTERVAL,
+            first=FOLLOWUP_POLL_INTERVAL,
+            name="followups",
+        )
+    application.job_queue.run_repeating(
+        expire_subscriptions,
+        interval=SUBSCRIPTION_SWEEP_INTERVAL,
+        first=SUBSCRIPTION_SWEEP_INTERVAL,
+        name="subscription_expiry",
+    )
+    if REPORTS_REFRESH_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            refresh_report_stats,
+            interval=REPORTS_REFRESH_INTERVAL,
+            first=REPORTS_REFRESH_INTERVAL,
+            name="report_stats",
+        )
+
+    return application
+
+
+def main() -> None:
+    """
+    Запуск бота в режиме polling (без вебхуков ЮKassa — они в отдельном сервисе).
+    Для приёма обновлений через вебхук запускайте webhook.py с TELEGRAM_WEBHOOK_URL.
+    """
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN не найден в переменных окружения!")
+        return
+
+    application = build_application()
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == '__main__':
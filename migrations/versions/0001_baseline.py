@@ -0,0 +1,102 @@
+"""baseline: схема, созданная до появления миграций
+
+Для уже работающей базы эту ревизию не применяют, а только отмечают:
+    alembic stamp 0001_baseline
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2025-09-01 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_baseline"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+payment_status = postgresql.ENUM(
+    "pending", "succeeded", "canceled", "failed", name="payment_status", create_type=False
+)
+subscription_status = postgresql.ENUM(
+    "active", "canceled", "expired", name="subscription_status", create_type=False
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    payment_status.create(op.get_bind(), checkfirst=True)
+    subscription_status.create(op.get_bind(), checkfirst=True)
+
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("telegram_id", sa.BigInteger(), nullable=False, unique=True),
+        sa.Column("username", sa.Text()),
+        sa.Column("first_name", sa.Text()),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("notification_24h_sent", sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column("notification_48h_sent", sa.Boolean(), nullable=False, server_default=sa.false()),
+    )
+    op.create_table(
+        "tariffs",
+        sa.Column("code", sa.String(), primary_key=True),
+        sa.Column("title", sa.Text(), nullable=False),
+        sa.Column("duration_months", sa.Integer(), nullable=False),
+        sa.Column("price_rub", sa.Numeric(12, 2), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+    op.execute(
+        """
+        INSERT INTO tariffs (code, title, duration_months, price_rub, created_at) VALUES
+            ('monthly', 'Помесячный', 1, 1490.00, now()),
+            ('stable', 'Стабильный', 3, 3990.00, now())
+        """
+    )
+    op.create_table(
+        "payments",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("tariff_code", sa.String(), sa.ForeignKey("tariffs.code"), nullable=False),
+        sa.Column("amount_rub", sa.Numeric(12, 2), nullable=False),
+        sa.Column("provider", sa.String(), nullable=False),
+        sa.Column("provider_payment_id", sa.String()),
+        sa.Column("status", payment_status, nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("paid_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("metadata", sa.JSON()),
+    )
+    op.create_table(
+        "subscriptions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("tariff_code", sa.String(), sa.ForeignKey("tariffs.code"), nullable=False),
+        sa.Column("start_at", sa.DateTime(), nullable=False),
+        sa.Column("end_at", sa.DateTime(), nullable=False),
+        sa.Column("status", subscription_status, nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+    op.create_table(
+        "payment_events",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("payments_id", sa.Integer(), sa.ForeignKey("payments.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("event", sa.Text(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("payment_events")
+    op.drop_table("subscriptions")
+    op.drop_table("payments")
+    op.drop_table("tariffs")
+    op.drop_table("users")
+    subscription_status.drop(op.get_bind(), checkfirst=True)
+    payment_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,81 @@
+"""media_assets, payment_reminders, payment_events.event_key, NOTIFY по tariffs
+
+Revision ID: 0002_media_reminders_events
+Revises: 0001_baseline
+Create Date: 2025-09-01 00:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_media_reminders_events"
+down_revision: Union[str, Sequence[str], None] = "0001_baseline"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # file_id медиафайлов в Telegram (services/media_assets.py)
+    op.create_table(
+        "media_assets",
+        sa.Column("content_hash", sa.String(64), primary_key=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("path", sa.Text(), nullable=False),
+        sa.Column("file_id", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+
+    # Отложенные напоминания об оплате (services/reminders.py)
+    op.create_table(
+        "payment_reminders",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("payment_id", sa.Integer(), sa.ForeignKey("payments.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("chat_id", sa.BigInteger(), nullable=False),
+        sa.Column("due_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("fired_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+    op.create_index(
+        "ix_payment_reminders_due_at_pending",
+        "payment_reminders",
+        ["due_at"],
+        postgresql_where=sa.text("fired_at IS NULL"),
+    )
+
+    # Ключ идемпотентности событий ЮKassa
+    op.add_column("payment_events", sa.Column("event_key", sa.String()))
+    op.create_unique_constraint("payment_events_event_key_key", "payment_events", ["event_key"])
+
+    # Сброс кэша тарифов во всех процессах (services/tariff_catalog.py слушает этот канал)
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_tariffs_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('tariffs_changed', TG_OP);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER tariffs_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tariffs
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_tariffs_changed()
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS tariffs_changed ON tariffs")
+    op.execute("DROP FUNCTION IF EXISTS notify_tariffs_changed()")
+    op.drop_constraint("payment_events_event_key_key", "payment_events", type_="unique")
+    op.drop_column("payment_events", "event_key")
+    op.drop_index("ix_payment_reminders_due_at_pending", table_name="payment_reminders")
+    op.drop_table("payment_reminders")
+    op.drop_table("media_assets")
@@ -0,0 +1,109 @@
+"""индексы под горячие запросы
+
+- subscriptions (user_id, end_at DESC) WHERE status = 'active'
+      activate_or_extend_subscription: активная подписка пользователя с максимальным end_at
+- subscriptions (user_id)                  — FK, каскадное удаление пользователя
+- payments (provider_payment_id) UNIQUE    — поиск платежа по id ЮKassa
+- payments (user_id, created_at)           — FK + выборка follow-up по возрасту платежа
+- payments (user_id) WHERE status = 'succeeded'
+      follow-up: «у пользователя нет оплаченного платежа»
+- payment_events (payments_id)             — FK
+- users (id) WHERE NOT notification_24h_sent / NOT notification_48h_sent
+      follow-up: кандидаты на 24ч/48ч уведомление
+
+Индексы создаются CONCURRENTLY, чтобы не блокировать запись в рабочей базе.
+
+Revision ID: 0003_hot_path_indexes
+Revises: 0002_media_reminders_events
+Create Date: 2025-09-01 00:20:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_hot_path_indexes"
+down_revision: Union[str, Sequence[str], None] = "0002_media_reminders_events"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    dict(
+        index_name="ix_subscriptions_user_active_end_at",
+        table_name="subscriptions",
+        columns=["user_id", sa.text("end_at DESC")],
+        postgresql_where=sa.text("status = 'active'"),
+    ),
+    dict(
+        index_name="ix_subscriptions_user_id",
+        table_name="subscriptions",
+        columns=["user_id"],
+    ),
+    dict(
+        index_name="uq_payments_provider_payment_id",
+        table_name="payments",
+        columns=["provider_payment_id"],
+        unique=True,
+        postgresql_where=sa.text("provider_payment_id IS NOT NULL"),
+    ),
+    dict(
+        index_name="ix_payments_user_id_created_at",
+        table_name="payments",
+        columns=["user_id", "created_at"],
+    ),
+    dict(
+        index_name="ix_payments_user_id_succeeded",
+        table_name="payments",
+        columns=["user_id"],
+        postgresql_where=sa.text("status = 'succeeded'"),
+    ),
+    dict(
+        index_name="ix_payment_events_payments_id",
+        table_name="payment_events",
+        columns=["payments_id"],
+    ),
+    dict(
+        index_name="ix_users_pending_24h",
+        table_name="users",
+        columns=["id"],
+        postgresql_where=sa.text("NOT notification_24h_sent"),
+    ),
+    dict(
+        index_name="ix_users_pending_48h",
+        table_name="users",
+        columns=["id"],
+        postgresql_where=sa.text("NOT notification_48h_sent"),
+    ),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Пустая строка раньше записывалась вместо отсутствующего id и мешает уникальному индексу
+    op.execute("UPDATE payments SET provider_payment_id = NULL WHERE provider_payment_id = ''")
+
+    with op.get_context().autocommit_block():
+        for index in INDEXES:
+            op.create_index(
+                index["index_name"],
+                index["table_name"],
+                index["columns"],
+                unique=index.get("unique", False),
+                postgresql_where=index.get("postgresql_where"),
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for index in reversed(INDEXES):
+            op.drop_index(
+                index["index_name"],
+                table_name=index["table_name"],
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
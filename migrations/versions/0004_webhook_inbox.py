@@ -0,0 +1,47 @@
+"""webhook_inbox: очередь событий ЮKassa для фонового воркера
+
+Revision ID: 0004_webhook_inbox
+Revises: 0003_hot_path_indexes
+Create Date: 2025-09-01 00:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_webhook_inbox"
+down_revision: Union[str, Sequence[str], None] = "0003_hot_path_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Вебхук только сохраняет событие, платёж и уведомление обрабатывает services/payment_worker.py
+    op.create_table(
+        "webhook_inbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("event_key", sa.String(), nullable=False, unique=True),
+        sa.Column("event", sa.Text(), nullable=False),
+        sa.Column("payload", sa.JSON()),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("next_attempt_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("applied_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("processed_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+    op.create_index(
+        "ix_webhook_inbox_next_attempt_pending",
+        "webhook_inbox",
+        ["next_attempt_at"],
+        postgresql_where=sa.text("processed_at IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_webhook_inbox_next_attempt_pending", table_name="webhook_inbox")
+    op.drop_table("webhook_inbox")
@@ -0,0 +1,49 @@
+"""outbox: сообщения, записанные в одной транзакции с изменением платежа
+
+webhook_inbox.applied_at больше не нужен: уведомление об оплате теперь пишется
+в outbox той же транзакцией, что и платёж, и событие обрабатывается за один шаг.
+
+Revision ID: 0005_outbox
+Revises: 0004_webhook_inbox
+Create Date: 2025-09-01 00:40:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_outbox"
+down_revision: Union[str, Sequence[str], None] = "0004_webhook_inbox"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("topic", sa.String(), nullable=False),
+        sa.Column("payload", sa.JSON()),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("next_attempt_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("sent_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+    op.create_index(
+        "ix_outbox_next_attempt_pending",
+        "outbox",
+        ["next_attempt_at"],
+        postgresql_where=sa.text("sent_at IS NULL"),
+    )
+    op.drop_column("webhook_inbox", "applied_at")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column("webhook_inbox", sa.Column("applied_at", sa.TIMESTAMP(timezone=True)))
+    op.drop_index("ix_outbox_next_attempt_pending", table_name="outbox")
+    op.drop_table("outbox")
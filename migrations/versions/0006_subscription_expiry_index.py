@@ -0,0 +1,46 @@
+"""индекс для перевода просроченных подписок в expired
+
+- subscriptions (end_at) WHERE status = 'active'
+      services/subscription_expiry.py: активные подписки с end_at < now()
+
+Создаётся CONCURRENTLY, как и остальные индексы на рабочих таблицах.
+
+Revision ID: 0006_subscription_expiry_index
+Revises: 0005_outbox
+Create Date: 2025-09-01 00:50:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_subscription_expiry_index"
+down_revision: Union[str, Sequence[str], None] = "0005_outbox"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_subscriptions_active_end_at",
+            "subscriptions",
+            ["end_at"],
+            postgresql_where=sa.text("status = 'active'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_subscriptions_active_end_at",
+            table_name="subscriptions",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,72 @@
+"""отчёты: дневные агрегаты платежей и индексы для выборок за период
+
+- daily_payment_stats — пересчитывается за последние дни (reports.py refresh,
+  задача в main.py), отчёты с --rollup читают её вместо payments
+- payments (created_at) — конверсия и time-to-pay по дате создания
+- payments (paid_at) WHERE status = 'succeeded' — выручка по дате оплаты
+
+Индексы на payments создаются CONCURRENTLY.
+
+Revision ID: 0007_reporting
+Revises: 0006_subscription_expiry_index
+Create Date: 2025-09-01 01:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0007_reporting"
+down_revision: Union[str, Sequence[str], None] = "0006_subscription_expiry_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "daily_payment_stats",
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("tariff_code", sa.String(), primary_key=True),
+        sa.Column("created", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_succeeded", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("paid", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("revenue", sa.Numeric(14, 2), nullable=False, server_default="0"),
+        sa.Column("refreshed_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_payments_created_at",
+            "payments",
+            ["created_at"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_payments_succeeded_paid_at",
+            "payments",
+            ["paid_at"],
+            postgresql_where=sa.text("status = 'succeeded'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_payments_succeeded_paid_at",
+            table_name="payments",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            "ix_payments_created_at",
+            table_name="payments",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+    op.drop_table("daily_payment_stats")
@@ -0,0 +1,39 @@
+"""funnel_events: шаги воронки (services/funnel.py)
+
+Пишутся пачками из буфера в памяти; отчёт "funnel" в reports.py считает
+по ним конверсию между шагами за период.
+
+Revision ID: 0008_funnel_events
+Revises: 0007_reporting
+Create Date: 2025-09-01 01:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0008_funnel_events"
+down_revision: Union[str, Sequence[str], None] = "0007_reporting"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "funnel_events",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("telegram_id", sa.BigInteger(), nullable=False),
+        sa.Column("step", sa.String(), nullable=False),
+        sa.Column("detail", sa.String()),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+    )
+    op.create_index("ix_funnel_events_created_at", "funnel_events", ["created_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_funnel_events_created_at", table_name="funnel_events")
+    op.drop_table("funnel_events")
@@ -1,7 +1,7 @@
 # models.py
-from datetime import datetime
+from datetime import date, datetime
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import BigInteger, String, Text, Numeric, ForeignKey, Enum, JSON, TIMESTAMP
+from sqlalchemy import BigInteger, String, Text, Numeric, ForeignKey, Enum, JSON, TIMESTAMP, Date, Index, text
 import enum
 from sqlalchemy.dialects.postgresql import ENUM as PGEnum
 
@@ -21,6 +21,11 @@ class SubscriptionStatus(str, enum.Enum):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # кандидаты на 24ч/48ч follow-up (services/followups.py)
+        Index("ix_users_pending_24h", "id", postgresql_where=text("NOT notification_24h_sent")),
+        Index("ix_users_pending_48h", "id", postgresql_where=text("NOT notification_48h_sent")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
@@ -44,6 +49,17 @@ class Tariff(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index(
+            "uq_payments_provider_payment_id", "provider_payment_id",
+            unique=True, postgresql_where=text("provider_payment_id IS NOT NULL"),
+        ),
+        Index("ix_payments_user_id_created_at", "user_id", "created_at"),
+        Index("ix_payments_user_id_succeeded", "user_id", postgresql_where=text("status = 'succeeded'")),
+        # отчёты (services/reports.py): платежи за период по дате создания и по дате оплаты
+        Index("ix_payments_created_at", "created_at"),
+        Index("ix_payments_succeeded_paid_at", "paid_at", postgresql_where=text("status = 'succeeded'")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
@@ -67,6 +83,16 @@ class Payment(Base):
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        # активная подписка пользователя с максимальным end_at (activate_or_extend_subscription)
+        Index(
+            "ix_subscriptions_user_active_end_at", "user_id", text("end_at DESC"),
+            postgresql_where=text("status = 'active'"),
+        ),
+        Index("ix_subscriptions_user_id", "user_id"),
+        # просроченные активные подписки (services/subscription_expiry.py)
+        Index("ix_subscriptions_active_end_at", "end_at", postgresql_where=text("status = 'active'")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
@@ -84,11 +110,107 @@ class Subscription(Base):
 
 class PaymentEvent(Base):
     __tablename__ = "payment_events"
+    __table_args__ = (
+        Index("ix_payment_events_payments_id", "payments_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     payments_id: Mapped[int] = mapped_column(ForeignKey("payments.id", ondelete="CASCADE"))
     event: Mapped[str] = mapped_column(Text)
+    # "<event>:<provider_payment_id>" — повторная доставка того же события от ЮKassa не пройдёт
+    event_key: Mapped[str | None] = mapped_column(String, unique=True)
     payload: Mapped[dict] = mapped_column(JSON)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=datetime.utcnow)
 
     payment: Mapped["Payment"] = relationship(back_populates="events")
+
+class MediaAsset(Base):
+    __tablename__ = "media_assets"
+
+    # sha256 содержимого файла: при замене картинки хэш меняется и файл загружается заново
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    kind: Mapped[str] = mapped_column(String, nullable=False)  # photo | video_note
+    path: Mapped[str] = mapped_column(Text, nullable=False)
+    file_id: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+
+class PaymentReminder(Base):
+    __tablename__ = "payment_reminders"
+    __table_args__ = (
+        # планировщик выбирает только ещё не отправленные напоминания по времени
+        Index("ix_payment_reminders_due_at_pending", "due_at", postgresql_where=text("fired_at IS NULL")),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    payment_id: Mapped[int] = mapped_column(ForeignKey("payments.id", ondelete="CASCADE"))
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    due_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    fired_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+
+class WebhookInbox(Base):
+    __tablename__ = "webhook_inbox"
+    __table_args__ = (
+        # воркер выбирает необработанные события, у которых подошло время попытки
+        Index("ix_webhook_inbox_next_attempt_pending", "next_attempt_at", postgresql_where=text("processed_at IS NULL")),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # тот же ключ, что в payment_events: повторная доставка ЮKassa не создаёт вторую строку
+    event_key: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    event: Mapped[str] = mapped_column(Text, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON)
+    attempts: Mapped[int] = mapped_column(default=0)
+    # NULL при processed_at IS NULL — попытки исчерпаны, нужен разбор вручную
+    next_attempt_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    processed_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    last_error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (
+        # relay выбирает неотправленные сообщения, у которых подошло время попытки
+        Index("ix_outbox_next_attempt_pending", "next_attempt_at", postgresql_where=text("sent_at IS NULL")),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # транспорт и тип сообщения, например "telegram.payment_succeeded" (services/outbox.py)
+    topic: Mapped[str] = mapped_column(String, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON)
+    attempts: Mapped[int] = mapped_column(default=0)
+    # NULL при sent_at IS NULL — попытки исчерпаны, нужен разбор вручную
+    next_attempt_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    sent_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    last_error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+
+class DailyPaymentStats(Base):
+    """Дневные агрегаты платежей для отчётов; пересчитываются за последние дни (services/reports.py)"""
+    __tablename__ = "daily_payment_stats"
+
+    # день в часовом поясе REPORTS_TZ
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    tariff_code: Mapped[str] = mapped_column(String, primary_key=True)
+    # платежи, созданные в этот день, и сколько из них в итоге оплачено
+    created: Mapped[int] = mapped_column(default=0)
+    created_succeeded: Mapped[int] = mapped_column(default=0)
+    # платежи, оплаченные в этот день, и их сумма
+    paid: Mapped[int] = mapped_column(default=0)
+    revenue: Mapped[float] = mapped_column(Numeric(14, 2), default=0)
+    refreshed_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+
+class FunnelEvent(Base):
+    __tablename__ = "funnel_events"
+    __table_args__ = (
+        # конверсия по шагам за период (services/reports.py)
+        Index("ix_funnel_events_created_at", "created_at"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    # шаг воронки из services/funnel.py: FUNNEL_STEPS
+    step: Mapped[str] = mapped_column(String, nullable=False)
+    # для шага "tariff" — код тарифа
+    detail: Mapped[str | None] = mapped_column(String)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=datetime.utcnow)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Отчёты по платежам и подпискам. Всё считается в SQL (GROUP BY, оконные функции),
+в Python приходят только готовые строки — можно запускать по cron или из n8n.
+
+Отчёты:
+    revenue             выручка по дням и тарифам, нарастающий итог, доля тарифа в дне
+    conversion          конверсия pending -> succeeded по дню создания платежа
+    time_to_pay         время от создания платежа до оплаты: p50/p90/p99, доли по порогам
+    active_subscribers  активные подписчики по тарифам, сколько заканчиваются в течение недели
+    funnel              воронка: пользователи на каждом шаге и конверсия между шагами
+    refresh             пересчитать daily_payment_stats за последние --days дней
+
+Использование:
+    DATABASE_URL=... python reports.py revenue --since 2025-09-01 --format csv
+    DATABASE_URL=... python reports.py conversion --rollup --format json
+    DATABASE_URL=... python reports.py refresh --days 3
+Период: --since (включительно) и --until (не включительно), по умолчанию последние 7 дней;
+дни считаются в часовом поясе --tz (REPORTS_TZ). --rollup читает revenue и conversion
+из daily_payment_stats вместо таблицы payments.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if not os.getenv("DATABASE_URL"):
+    sys.exit("DATABASE_URL не задан")
+
+from db import get_session, engine
+from services.reports import REPORTS, REPORTS_TZ, ReportParams, ReportResult, refresh_daily_stats
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def print_table(result: ReportResult) -> None:
+    rows = [[_format_value(v) for v in row] for row in result.rows]
+    widths = [max([len(c)] + [len(r[i]) for r in rows]) for i, c in enumerate(result.columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(result.columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+    print(f"Строк: {len(rows)}")
+
+
+def print_csv(result: ReportResult) -> None:
+    writer = csv.writer(sys.stdout)
+    writer.writerow(result.columns)
+    writer.writerows([_format_value(v) for v in row] for row in result.rows)
+
+
+def print_json(result: ReportResult) -> None:
+    json.dump(result.as_dicts(), sys.stdout, ensure_ascii=False, indent=2, default=_format_value)
+    print()
+
+
+FORMATS = {"table": print_table, "csv": print_csv, "json": print_json}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Отчёты по платежам и подпискам")
+    parser.add_argument("report", choices=[*REPORTS, "refresh"])
+    parser.add_argument("--since", type=date.fromisoformat, help="первый день периода, YYYY-MM-DD")
+    parser.add_argument("--until", type=date.fromisoformat, help="день после конца периода, YYYY-MM-DD")
+    parser.add_argument("--tz", default=REPORTS_TZ, help="часовой пояс для границ дней")
+    parser.add_argument("--format", choices=FORMATS, default="table")
+    parser.add_argument("--rollup", action="store_true", help="читать дневные агрегаты из daily_payment_stats")
+    parser.add_argument("--days", type=int, default=3, help="refresh: сколько последних дней пересчитать")
+    args = parser.parse_args()
+
+    try:
+        if args.report == "refresh":
+            async with get_session() as session:
+                rows = await refresh_daily_stats(session, days=args.days, tz=args.tz)
+                await session.commit()
+            print(f"daily_payment_stats: обновлено строк {rows} за {args.days} дн.")
+            return
+
+        today = datetime.now(ZoneInfo(args.tz)).date()
+        until = args.until or today + timedelta(days=1)
+        params = ReportParams(
+            since=args.since or until - timedelta(days=7),
+            until=until,
+            tz=args.tz,
+            from_rollup=args.rollup,
+        )
+        async with get_session() as session:
+            result = await REPORTS[args.report](session, params)
+    finally:
+        await engine.dispose()
+    FORMATS[args.format](result)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
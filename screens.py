@@ -0,0 +1,190 @@
+# screens.py
+"""
+Экраны воронки: текст, parse_mode, клавиатура и картинка каждого ответа на кнопку.
+Собираются один раз в неизменяемые шаги (services/sequences.py) и пересобираются
+только когда меняется справочник тарифов — хендлеру остаётся их отправить.
+"""
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+
+from services.sequences import PhotoStep, TextStep, Step
+from services.tariff_catalog import tariff_catalog
+
+OFERTA_URL = "https://docs.yandex.ru/docs/view?url=ya-disk-public%3A%2F%2FZkx7HkIuQDpkVUiXOfvHBOO%2FQPNC9%2Fxb%2BiOzOS22ub%2FpW7TeWe4Yk3b3NEtMKypTq%2FJ6bpmRyOJonT3VoXnDag%3D%3D"
+OFERTA_DOC_URL = OFERTA_URL + "&name=%D0%9E%D1%84%D1%84%D0%B5%D1%80%D1%82%D0%B0%20MarketSkills%20(2).docx&nosw=1"
+INSTRUCTION_URL = "https://disk.yandex.ru/d/4UDQVRfIjnfUSw"
+FOREIGN_PAYMENT_URL = "https://t.me/tribute/app?startapp=ep_8xY0SyWiII0m5WAIvnXUKtqnazJqBXJjWYaks9qLwjy6iK7m80"
+
+
+# ================== ТАРИФЫ (из справочника в памяти) ==================
+def tariff_keyboard_rows() -> list[list[InlineKeyboardButton]]:
+    """Кнопки выбора тарифа: 'Тариф Помесячный — 1490₽/мес.' -> tariff_monthly"""
+    return [
+        [InlineKeyboardButton(t.button_label, callback_data=f"tariff_{t.code}")]
+        for t in tariff_catalog.all()
+    ]
+
+
+def tariff_list_text() -> str:
+    """Строки вида 'Помесячный - 1490₽/мес.' для описаний тарифов"""
+    return "\n".join(f"{t.title} - {t.period_text} " for t in tariff_catalog.all())
+
+
+def monthly_price_text() -> str:
+    """Цена самого короткого тарифа, например '1490₽'"""
+    tariffs = tariff_catalog.all()
+    if not tariffs:
+        return ""
+    return min(tariffs, key=lambda t: t.duration_months).price_text
+
+
+# ================== ТЕКСТЫ ==================
+def get_community_text() -> str:
+    """Описание комьюнити (цена — из справочника тарифов)"""
+    return f"""<b>Открываю тебе доступ в закрытое комьюнити, но знай что...</b> 
+
+Здесь, люди зарабатывают онлайн, позабыв о "работы ради работы" 
+
+📦 Здесь заходят в маркетплейсы с 0
+даже без товаров — и вот почему:
+
+💥 Каждые 2 недели — разборы направлений, кейсы с реальными результатами и эфиры 
+
+🫂 Чат с поддержкой: можешь задать вопрос по проекту, сделке, карточке или запуску — подскажут, как сделать лучше.
+
+📚 Пошаговые уроки: как стать менеджером маркетплейсов и всё 
+это без "курсов за 100к".
+
+🤝 Ты не просто подписчик — ты часть команды. Здесь находят клиентов, запускают свои первые проекты 
+
+А ещё — тут по-настоящему тёплая движуха. Вместе шутим про поставщиков, скидываем факапы, обсуждаем маркетплейсные тренды и помогаем друг другу не сгореть.
+
+И всё это — за {monthly_price_text()} в месяц.
+Когда, если не сейчас. Вступай!"""
+
+
+def tariffs_overview_text() -> str:
+    """Список тарифов под фото photo2"""
+    return f"""Выбирай подходящий тариф! 👌🏻
+
+{tariff_list_text()}
+
+По всем вопросам: оплаты или просто так, пишите сюда :)
+@spoddershka"""
+
+
+SUPPORT_TEXT = """🆘 <b>Поддержка MarketSkills</b>
+
+По всем вопросам оплаты или работы с платформой обращайтесь к:
+
+👤 @spoddershka
+
+Он поможет решить любые вопросы и проблемы! 😊"""
+
+
+# ================== ЭКРАНЫ ==================
+def _keyboard(*rows: list[InlineKeyboardButton]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(rows)
+
+
+def build_screens() -> dict[str, Step]:
+    """Все экраны с уже подставленными ценами из справочника тарифов"""
+    payment_methods = TextStep(
+        "<b>Выберите способ оплаты</b> 💳:",
+        parse_mode=ParseMode.HTML,
+        reply_markup=_keyboard(
+            [InlineKeyboardButton("Оплата картой РФ 🇷🇺", callback_data='payment_rf_card')],
+            [InlineKeyboardButton("Оплата не РФ 🌍", callback_data='payment_foreign_card')],
+        ),
+    )
+    tariffs_overview = tariffs_overview_text()
+
+    return {
+        # "Все супер, дальше🚀" — описание комьюнити с кнопкой подключения
+        "community": PhotoStep(
+            "content/photo3.jpg",
+            caption=get_community_text(),
+            parse_mode=ParseMode.HTML,
+            reply_markup=_keyboard([InlineKeyboardButton("💥 Подключиться 💥", callback_data='connect_community')]),
+        ),
+        # "Смотреть видео 📹" — картинка с инструкцией и кнопкой дальше
+        "video_instructions": PhotoStep(
+            "content/3810.JPG",
+            reply_markup=_keyboard(
+                [InlineKeyboardButton("Смотреть инструкцию 👀", url=INSTRUCTION_URL)],
+                [InlineKeyboardButton("Все супер, дальше🚀", callback_data='all_good_continue')],
+            ),
+            fallback_text="Выберите действие:",
+        ),
+        # "💥Подключиться к комьюнити"
+        "tariffs_overview": PhotoStep(
+            "content/photo2.jpg",
+            caption=tariffs_overview,
+            reply_markup=_keyboard([InlineKeyboardButton("🤝 Выбрать тариф 🤝", callback_data='choose_tariff_step')]),
+        ),
+        # "🤝Выбрать тариф" — согласие с офертой
+        "oferta": TextStep(
+            f"""<b>Ты уже в шаге от нас!</b> 🥹
+Перед тем как тебя перенаправит на оплату, нажимая на кнопку: <b>"Далее"</b> ты соглашаешься с <a href="{OFERTA_URL}">Публичной офферты</a>""",
+            parse_mode=ParseMode.HTML,
+            reply_markup=_keyboard([InlineKeyboardButton("Далее", callback_data='proceed_to_payment')]),
+            disable_web_page_preview=True,
+        ),
+        "payment_methods": payment_methods,
+        "foreign_payment": TextStep(
+            "Для оплаты картой иностранного банка нажмите кнопку ниже:",
+            reply_markup=_keyboard([InlineKeyboardButton("💳 Перейти к оплате", url=FOREIGN_PAYMENT_URL)]),
+        ),
+        "tariff_choice": TextStep(
+            "Выберите тариф 👇",
+            reply_markup=_keyboard(*tariff_keyboard_rows()),
+        ),
+        "learn_more": TextStep(
+            'Нажимая "Далее" вы соглашаетесь с условиями публичной '
+            f'<a href="{OFERTA_DOC_URL}">ОФФЕРТЫ</a> 📄'
+            '\nинн: 051701385730 ИП Газиев Шамиль Газиевич',
+            parse_mode=ParseMode.HTML,
+            reply_markup=_keyboard(
+                [InlineKeyboardButton("Посмотреть оферту 📄", url=OFERTA_DOC_URL)],
+                [InlineKeyboardButton("ДАЛЕЕ", callback_data='next_step')],
+            ),
+            disable_web_page_preview=True,
+        ),
+        "tariffs_overview_next": PhotoStep(
+            "content/photo2.jpg",
+            caption=tariffs_overview,
+            reply_markup=_keyboard([InlineKeyboardButton("Выбрать тариф 🚀", callback_data='choose_tariff')]),
+        ),
+        "tariff_choice_back": TextStep(
+            "Выберите тариф 👇",
+            reply_markup=_keyboard(
+                *tariff_keyboard_rows(),
+                [InlineKeyboardButton("↩️ Назад", callback_data='next_step')],
+            ),
+        ),
+        "support": TextStep(SUPPORT_TEXT, parse_mode=ParseMode.HTML),
+    }
+
+
+class ScreenRegistry:
+    """
+    Экраны, собранные заранее. Пересобираются лениво, когда справочник
+    тарифов перезагрузился (изменилась его version), а не на каждое нажатие.
+    """
+
+    def __init__(self):
+        self._screens: dict[str, Step] = {}
+        self._version = -1
+
+    def build(self) -> None:
+        self._screens = build_screens()
+        self._version = tariff_catalog.version
+
+    def get(self, name: str) -> Step:
+        if self._version != tariff_catalog.version:
+            self.build()
+        return self._screens[name]
+
+
+# Глобальный реестр экранов
+screens = ScreenRegistry()
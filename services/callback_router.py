@@ -0,0 +1,72 @@
+# services/callback_router.py
+from typing import Any, Awaitable, Callable, Optional
+
+from services.metrics import HANDLER_LATENCY, HANDLER_ERRORS
+
+# handler(update, context) для точных ключей и handler(update, context, suffix) для префиксов
+Handler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRouter:
+    """
+    Таблица маршрутов для callback_data inline-кнопок.
+
+    Точные ключи ('watch_video') ищутся в dict за O(1), параметризованные
+    ('tariff_<code>', 'retry_payment_<id>') — по префиксам, от самого длинного
+    к короткому, чтобы 'tariff_' не перехватывал более специфичный префикс.
+    """
+
+    def __init__(self):
+        self._exact: dict[str, Handler] = {}
+        self._prefixes: list[tuple[str, Handler]] = []
+
+    def exact(self, *keys: str) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            for key in keys:
+                if key in self._exact:
+                    raise ValueError(f"Callback '{key}' уже зарегистрирован")
+                self._exact[key] = handler
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            if any(p == prefix for p, _ in self._prefixes):
+                raise ValueError(f"Префикс '{prefix}' уже зарегистрирован")
+            self._prefixes.append((prefix, handler))
+            self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            return handler
+        return decorator
+
+    def _match(self, data: str) -> Optional[tuple[str, Handler, Optional[str]]]:
+        """(ключ маршрута, handler, suffix): ключ — сама callback_data или её префикс"""
+        handler = self._exact.get(data)
+        if handler is not None:
+            return data, handler, None
+        for prefix, handler in self._prefixes:
+            if data.startswith(prefix):
+                return prefix, handler, data[len(prefix):]
+        return None
+
+    def resolve(self, data: str) -> Optional[tuple[Handler, Optional[str]]]:
+        """(handler, suffix) для callback_data; suffix = None у точных ключей"""
+        match = self._match(data)
+        return match[1:] if match else None
+
+    async def dispatch(self, update, context) -> bool:
+        """Вызывает обработчик; False — для такой callback_data маршрута нет"""
+        match = self._match(update.callback_query.data or "")
+        if match is None:
+            return False
+        # метка — ключ маршрута, а не callback_data: 'tariff_', а не 'tariff_m1'
+        key, handler, suffix = match
+        with HANDLER_LATENCY.time(key):
+            try:
+                if suffix is None:
+                    await handler(update, context)
+                else:
+                    await handler(update, context, suffix)
+            except Exception:
+                HANDLER_ERRORS.inc(key)
+                raise
+        return True
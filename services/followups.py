@@ -0,0 +1,83 @@
+# services/followups.py
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, Payment, PaymentStatus
+
+FOLLOWUP_DELAYS = {
+    "24h": timedelta(hours=24),
+    "48h": timedelta(hours=48),
+}
+
+# Платежи старше этого окна не догоняем сообщениями (например, при первом включении)
+FOLLOWUP_MAX_AGE = timedelta(days=7)
+
+async def claim_due_followups(
+    session: AsyncSession,
+    notification_type: str,
+    limit: int = 500,
+    max_age: timedelta = FOLLOWUP_MAX_AGE,
+) -> list[tuple[int, int]]:
+    """
+    Одним запросом выбирает неоплативших пользователей, у которых с момента
+    создания платежа прошло 24/48 часов, и сразу проставляет им флаг
+    notification_24h_sent / notification_48h_sent. Возвращает [(user_id, telegram_id)].
+
+    48ч-уведомление помечает и 24ч как отправленное: если пользователь дождался
+    48 часов раньше, чем до него дошла очередь 24ч, второе сообщение уже не нужно.
+    """
+    now = datetime.now(timezone.utc)
+    delay = FOLLOWUP_DELAYS[notification_type]
+
+    if notification_type == "24h":
+        flag = User.notification_24h_sent
+        values = {"notification_24h_sent": True}
+    else:
+        flag = User.notification_48h_sent
+        values = {"notification_48h_sent": True, "notification_24h_sent": True}
+
+    has_due_payment = exists().where(
+        Payment.user_id == User.id,
+        Payment.created_at <= now - delay,
+        Payment.created_at > now - max_age,
+    )
+    has_paid = exists().where(
+        Payment.user_id == User.id,
+        Payment.status == PaymentStatus.succeeded,
+    )
+    due_ids = (
+        select(User.id)
+        .where(flag.is_(False), has_due_payment, ~has_paid)
+        .limit(limit)
+        .with_for_update(skip_locked=True, of=User)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(User)
+        .where(User.id.in_(due_ids))
+        .values(**values)
+        .returning(User.id, User.telegram_id)
+    )
+    return [(row.id, row.telegram_id) for row in result]
+
+def _followup_flag(notification_type: str):
+    return User.notification_24h_sent if notification_type == "24h" else User.notification_48h_sent
+
+async def claim_followup(session: AsyncSession, user_id: int, notification_type: str) -> bool:
+    """
+    Ставит флаг уведомления до отправки (для уведомлений, пришедших через N8N).
+    False — флаг уже стоит: повтор запроса N8N или сообщение уже отправил движок.
+    """
+    flag = _followup_flag(notification_type)
+    claimed = await session.scalar(
+        update(User)
+        .where(User.id == user_id, flag.is_(False))
+        .values({flag: True})
+        .returning(User.id)
+    )
+    return claimed is not None
+
+async def release_followup(session: AsyncSession, user_id: int, notification_type: str) -> None:
+    """Снимает флаг, если отправка не удалась: повтор N8N отправит сообщение ещё раз"""
+    flag = _followup_flag(notification_type)
+    await session.execute(update(User).where(User.id == user_id).values({flag: False}))
@@ -0,0 +1,122 @@
+# services/funnel.py
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import insert
+
+from db import get_session
+from models import FunnelEvent
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Шаги воронки по порядку: /start и callback_data кнопок; все tariff_* — один шаг "tariff"
+FUNNEL_STEPS = [
+    "start",
+    "watch_video",
+    "all_good_continue",
+    "choose_tariff_step",
+    "proceed_to_payment",
+    "payment_rf_card",
+    "tariff",
+]
+TARIFF_PREFIX = "tariff_"
+# asyncpg/PostgreSQL: не больше 32767 параметров на запрос, у строки события их 4
+MAX_ROWS_PER_INSERT = 32767 // 4
+
+
+def funnel_step(callback_data: str) -> tuple[Optional[str], Optional[str]]:
+    """(шаг, детали) для callback_data кнопки или (None, None), если кнопка не из воронки"""
+    if callback_data.startswith(TARIFF_PREFIX):
+        return "tariff", callback_data[len(TARIFF_PREFIX):]
+    if callback_data in FUNNEL_STEPS:
+        return callback_data, None
+    return None, None
+
+
+class FunnelRecorder:
+    """
+    Запись шагов воронки без похода в БД на каждое нажатие: record() только кладёт
+    событие в кольцевой буфер, фоновая задача сбрасывает его одним многострочным
+    INSERT каждые flush_size событий или flush_interval_ms миллисекунд.
+
+    Память ограничена buffer_size: если БД не успевает, теряются самые старые
+    события (счётчик dropped). Пачка, которую не удалось записать, тоже
+    отбрасывается — это аналитика, повторять её ценой задержки кнопок не нужно.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("FUNNEL_ENABLED", "1") == "1"
+        self.buffer_size = int(os.getenv("FUNNEL_BUFFER_SIZE", "10000"))
+        self.flush_size = min(int(os.getenv("FUNNEL_FLUSH_SIZE", "500")), MAX_ROWS_PER_INSERT)
+        self.flush_interval = int(os.getenv("FUNNEL_FLUSH_INTERVAL_MS", "1000")) / 1000
+        self.dropped = 0
+        self._buffer: deque[dict] = deque(maxlen=self.buffer_size)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            # то, что накопилось с последнего сброса
+            while self._buffer and await self.flush():
+                pass
+
+    def record(self, telegram_id: int, step: str, detail: Optional[str] = None) -> None:
+        if self._task is None:
+            return
+        if len(self._buffer) == self.buffer_size:
+            self.dropped += 1  # deque(maxlen) вытеснит самое старое событие
+        self._buffer.append({
+            "telegram_id": telegram_id,
+            "step": step,
+            "detail": detail,
+            "created_at": datetime.now(timezone.utc),
+        })
+        if len(self._buffer) >= self.flush_size:
+            self._wakeup.set()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # пока буфер полон на целую пачку — пишем без ожидания; ошибка БД прерывает до следующего тика
+            while await self.flush() == self.flush_size:
+                pass
+
+    async def flush(self) -> int:
+        """Записывает до flush_size событий из буфера, возвращает их число (0 — ошибка или пусто)"""
+        batch = [self._buffer.popleft() for _ in range(min(self.flush_size, len(self._buffer)))]
+        if not batch:
+            return 0
+        try:
+            async with get_session() as session:
+                # именно .values(batch): execute(insert(...), batch) на asyncpg — executemany, INSERT на строку
+                await session.execute(insert(FunnelEvent).values(batch))
+                await session.commit()
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"Не удалось записать {len(batch)} событий воронки (всего потеряно {self.dropped}): {e}")
+            return 0
+        return len(batch)
+
+
+# Глобальный экземпляр записи воронки
+funnel_recorder = FunnelRecorder()
+
+metrics.gauge("funnel_buffer_events", "Событий воронки в буфере", lambda: len(funnel_recorder._buffer))
+metrics.gauge("funnel_dropped_events", "Событий воронки потеряно с запуска", lambda: funnel_recorder.dropped)
@@ -0,0 +1,161 @@
+# services/media_assets.py
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import aiofiles
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from telegram import Bot, Message
+from telegram.error import BadRequest
+
+from db import get_session
+from models import MediaAsset
+
+logger = logging.getLogger(__name__)
+
+# Корень проекта: пути вида "content/photo4.jpg" считаем относительно него
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+class MediaAssetRegistry:
+    """
+    Реестр медиафайлов: каждый файл загружается в Telegram один раз,
+    полученный file_id сохраняется в таблицу media_assets по sha256 содержимого
+    и дальше переиспользуется и ботом, и webhook-сервисом.
+    """
+
+    def __init__(self):
+        # path -> (mtime, size, sha256), чтобы не хэшировать файл на каждую отправку
+        self._hashes: dict[Path, tuple[float, int, str]] = {}
+        # sha256 -> file_id
+        self._file_ids: dict[str, str] = {}
+        # sha256 -> lock первой загрузки; файлов единицы, поэтому не удаляем
+        self._upload_locks: dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _resolve(path: str | Path) -> Path:
+        path = Path(path)
+        return path if path.is_absolute() else BASE_DIR / path
+
+    def content_hash(self, path: str | Path) -> str:
+        path = self._resolve(path)
+        stat = path.stat()  # FileNotFoundError пробрасываем вызывающему
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        self._hashes[path] = (stat.st_mtime, stat.st_size, content_hash)
+        return content_hash
+
+    async def get_file_id(self, content_hash: str) -> str | None:
+        file_id = self._file_ids.get(content_hash)
+        if file_id:
+            return file_id
+
+        try:
+            async with get_session() as session:
+                file_id = await session.scalar(
+                    select(MediaAsset.file_id).where(MediaAsset.content_hash == content_hash)
+                )
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать file_id из БД: {e}")
+            return None
+        if file_id:
+            self._file_ids[content_hash] = file_id
+        return file_id
+
+    async def remember(self, content_hash: str, path: Path, kind: str, file_id: str) -> None:
+        self._file_ids[content_hash] = file_id
+        stmt = pg_insert(MediaAsset).values(
+            content_hash=content_hash,
+            kind=kind,
+            path=str(path.relative_to(BASE_DIR) if path.is_relative_to(BASE_DIR) else path),
+            file_id=file_id,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MediaAsset.content_hash],
+            set_={"file_id": stmt.excluded.file_id, "path": stmt.excluded.path},
+        )
+        try:
+            async with get_session() as session:
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            # Кэш в памяти всё равно работает, в БД запишем при следующей загрузке
+            logger.warning(f"Не удалось сохранить file_id для {path}: {e}")
+
+    async def forget(self, content_hash: str, file_id: str) -> None:
+        """Удаляет именно устаревший file_id: новый, уже загруженный другим вызовом, не трогаем"""
+        if self._file_ids.get(content_hash) == file_id:
+            del self._file_ids[content_hash]
+        try:
+            async with get_session() as session:
+                await session.execute(
+                    delete(MediaAsset).where(MediaAsset.content_hash == content_hash, MediaAsset.file_id == file_id)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Не удалось удалить устаревший file_id {content_hash}: {e}")
+
+    async def _send(
+        self,
+        kind: str,
+        path: str | Path,
+        send: Callable[[object], Awaitable[Message]],
+        extract_file_id: Callable[[Message], str | None],
+    ) -> Message:
+        path = self._resolve(path)
+        content_hash = self.content_hash(path)
+
+        file_id = await self.get_file_id(content_hash)
+        if file_id:
+            try:
+                return await send(file_id)
+            except BadRequest as e:
+                # file_id привязан к боту: при смене токена он становится невалидным
+                logger.warning(f"file_id для {path} не принят Telegram ({e}), загружаем файл заново")
+                await self.forget(content_hash, file_id)
+
+        # На холодном кэше (всплеск /start) файл загружает только первый вызов,
+        # остальные ждут его file_id, а не грузят тот же файл параллельно
+        lock = self._upload_locks.setdefault(content_hash, asyncio.Lock())
+        async with lock:
+            file_id = await self.get_file_id(content_hash)
+            if file_id is None:
+                async with aiofiles.open(path, "rb") as f:
+                    data = await f.read()
+                message = await send(data)
+
+                new_file_id = extract_file_id(message)
+                if new_file_id:
+                    await self.remember(content_hash, path, kind, new_file_id)
+                return message
+        return await send(file_id)
+
+    async def send_photo(self, bot: Bot, chat_id: int, path: str | Path, **kwargs) -> Message:
+        return await self._send(
+            "photo",
+            path,
+            lambda photo: bot.send_photo(chat_id=chat_id, photo=photo, **kwargs),
+            lambda message: message.photo[-1].file_id if message.photo else None,
+        )
+
+    async def send_video_note(self, bot: Bot, chat_id: int, path: str | Path, **kwargs) -> Message:
+        return await self._send(
+            "video_note",
+            path,
+            lambda video_note: bot.send_video_note(chat_id=chat_id, video_note=video_note, **kwargs),
+            lambda message: message.video_note.file_id if message.video_note else None,
+        )
+
+
+# Глобальный экземпляр реестра
+media_assets = MediaAssetRegistry()
@@ -0,0 +1,242 @@
+# services/metrics.py
+import os
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}_total{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        # на набор меток: [счётчики по корзинам (последняя — +Inf)..., сумма]
+        self._values: dict[LabelValues, list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {_number(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {_number(cumulative)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение читается в момент выгрузки: число или {значения меток: число}"""
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Union[float, dict[LabelValues, float]]],
+        labelnames: tuple[str, ...] = (),
+    ):
+        super().__init__(name, help, labelnames)
+        self.read = read
+
+    def _samples(self) -> list[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.debug(f"Метрика {self.name} недоступна: {e}")
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}" for labels, v in values.items()]
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в формате Prometheus (text exposition 0.0.4).
+
+    Запись — это словарь и сложение в потоке event loop: ни блокировок, ни
+    сериализации, поэтому метрики можно держать включёнными в продакшене.
+    Метки только с ограниченным набором значений (имя обработчика, метод API),
+    никаких chat_id и callback_data целиком.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(
+        self, name: str, help: str, read: Callable[[], Union[float, dict[LabelValues, float]]],
+        labelnames: tuple[str, ...] = (),
+    ) -> Gauge:
+        return self._register(Gauge(name, help, read, labelnames))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+# Глобальный реестр метрик процесса
+metrics = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ------------------ Метрики приложения ------------------
+HANDLER_LATENCY = metrics.histogram(
+    "bot_handler_duration_seconds", "Время обработки команды или нажатия кнопки", ("handler",)
+)
+HANDLER_ERRORS = metrics.counter("bot_handler_errors", "Исключения в обработчиках", ("handler",))
+
+DB_POOL_WAIT = metrics.histogram(
+    "db_pool_checkout_wait_seconds", "Ожидание свободного соединения из пула SQLAlchemy",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+
+TELEGRAM_LATENCY = metrics.histogram(
+    "telegram_api_duration_seconds", "Время запроса к Bot API (без ожидания лимитов)", ("method",)
+)
+TELEGRAM_ERRORS = metrics.counter("telegram_api_errors", "Ошибки запросов к Bot API", ("method", "error"))
+TELEGRAM_RATE_LIMIT_WAIT = metrics.histogram(
+    "telegram_rate_limit_wait_seconds", "Ожидание слота в ограничителе запросов к Bot API", ("priority",)
+)
+
+YOOKASSA_LATENCY = metrics.histogram("yookassa_request_duration_seconds", "Время запроса к API ЮKassa", ("operation",))
+YOOKASSA_ERRORS = metrics.counter("yookassa_request_errors", "Ошибки запросов к API ЮKassa", ("operation",))
+
+N8N_LATENCY = metrics.histogram("n8n_request_duration_seconds", "Время запроса к вебхукам N8N", ("webhook",))
+N8N_ERRORS = metrics.counter("n8n_request_errors", "Ошибки и не-2xx ответы вебхуков N8N", ("webhook",))
+
+HTTP_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса webhook-сервисом", ("route", "status")
+)
+PAYMENT_EVENT_LATENCY = metrics.histogram(
+    "payment_event_processing_seconds", "Обработка события ЮKassa воркером (транзакция платежа)", ("result",)
+)
+
+
+# ------------------ Отдельный HTTP-сервер для процесса бота ------------------
+class MetricsServer:
+    """
+    /metrics для main.py в режиме polling (у webhook.py свой endpoint в FastAPI).
+    Включается переменной METRICS_PORT.
+    """
+
+    def __init__(self):
+        port = os.getenv("METRICS_PORT")
+        self.port: Optional[int] = int(port) if port else None
+        self.host = os.getenv("METRICS_HOST", "0.0.0.0")
+        self._runner = None
+
+    async def start(self) -> None:
+        if self.port is None or self._runner is not None:
+            return
+        from aiohttp import web
+
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(body=metrics.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Глобальный экземпляр сервера метрик
+metrics_server = MetricsServer()
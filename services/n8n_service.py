@@ -1,11 +1,13 @@
 # services/n8n_service.py
 import os
-import asyncio
+import time
 import httpx
 import logging
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any
 
+from services.metrics import N8N_LATENCY, N8N_ERRORS
+
 logger = logging.getLogger(__name__)
 
 class N8NService:
@@ -15,6 +17,47 @@ class N8NService:
         self.webhook_url_24h_user = os.getenv("N8N_WEBHOOK_URL_24H_USER")
         self.webhook_url_48h_user = os.getenv("N8N_WEBHOOK_URL_48H_USER")
         self.timeout = 10.0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        """Создаёт один keep-alive клиент на весь процесс"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                headers={"Content-Type": "application/json"},
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _webhook_name(self, url: str) -> str:
+        """Метка для метрик: какой из настроенных вебхуков, а не сам URL"""
+        names = {
+            self.webhook_url_24h: "payment_created_24h",
+            self.webhook_url_48h: "payment_created_48h",
+            self.webhook_url_24h_user: "user_24h",
+            self.webhook_url_48h_user: "user_48h",
+        }
+        return names.get(url, "other")
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        if self._client is None:
+            await self.start()
+        name = self._webhook_name(url)
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(url, json=payload)
+        except Exception:
+            N8N_ERRORS.inc(name)
+            raise
+        finally:
+            N8N_LATENCY.observe(time.perf_counter() - started, name)
+        if response.status_code >= 400:
+            N8N_ERRORS.inc(name)
+        return response
     
     async def send_payment_created_notification(
         self, 
@@ -47,20 +90,15 @@ class N8NService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    self.webhook_url_24h,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"Успешно отправлено 24ч уведомление в N8N для платежа {payment_id}")
-                    return True
-                else:
-                    logger.error(f"Ошибка отправки 24ч уведомления в N8N: {response.status_code} - {response.text}")
-                    return False
-                    
+            response = await self._post(self.webhook_url_24h, payload)
+
+            if response.status_code == 200:
+                logger.info(f"Успешно отправлено 24ч уведомление в N8N для платежа {payment_id}")
+                return True
+            else:
+                logger.error(f"Ошибка отправки 24ч уведомления в N8N: {response.status_code} - {response.text}")
+                return False
+
         except httpx.TimeoutException:
             logger.error(f"Timeout при отправке уведомления в N8N для платежа {payment_id}")
             return False
@@ -99,20 +137,15 @@ class N8NService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    self.webhook_url_48h,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"Успешно отправлено 48ч уведомление в N8N для платежа {payment_id}")
-                    return True
-                else:
-                    logger.error(f"Ошибка отправки 48ч уведомления в N8N: {response.status_code} - {response.text}")
-                    return False
-                    
+            response = await self._post(self.webhook_url_48h, payload)
+
+            if response.status_code == 200:
+                logger.info(f"Успешно отправлено 48ч уведомление в N8N для платежа {payment_id}")
+                return True
+            else:
+                logger.error(f"Ошибка отправки 48ч уведомления в N8N: {response.status_code} - {response.text}")
+                return False
+
         except httpx.TimeoutException:
             logger.error(f"Timeout при отправке 48ч уведомления в N8N для платежа {payment_id}")
             return False
@@ -135,20 +168,15 @@ class N8NService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    self.webhook_url_24h_user,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"Успешно отправлено 24ч уведомление пользователю {notification_data['telegram_id']}")
-                    return True
-                else:
-                    logger.error(f"Ошибка отправки 24ч уведомления пользователю: {response.status_code} - {response.text}")
-                    return False
-                    
+            response = await self._post(self.webhook_url_24h_user, payload)
+
+            if response.status_code == 200:
+                logger.info(f"Успешно отправлено 24ч уведомление пользователю {notification_data['telegram_id']}")
+                return True
+            else:
+                logger.error(f"Ошибка отправки 24ч уведомления пользователю: {response.status_code} - {response.text}")
+                return False
+
         except httpx.TimeoutException:
             logger.error(f"Timeout при отправке 24ч уведомления пользователю {notification_data['telegram_id']}")
             return False
@@ -171,20 +199,15 @@ class N8NService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    self.webhook_url_48h_user,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"Успешно отправлено 48ч уведомление пользователю {notification_data['telegram_id']}")
-                    return True
-                else:
-                    logger.error(f"Ошибка отправки 48ч уведомления пользователю: {response.status_code} - {response.text}")
-                    return False
-                    
+            response = await self._post(self.webhook_url_48h_user, payload)
+
+            if response.status_code == 200:
+                logger.info(f"Успешно отправлено 48ч уведомление пользователю {notification_data['telegram_id']}")
+                return True
+            else:
+                logger.error(f"Ошибка отправки 48ч уведомления пользователю: {response.status_code} - {response.text}")
+                return False
+
         except httpx.TimeoutException:
             logger.error(f"Timeout при отправке 48ч уведомления пользователю {notification_data['telegram_id']}")
             return False
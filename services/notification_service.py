@@ -1,8 +1,45 @@
 # services/notification_service.py
+import os
 import re
-from typing import Dict, Any
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import time
+import logging
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Optional
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
+from telegram.error import Forbidden, RetryAfter
+
+from services.media_assets import media_assets, BASE_DIR
+from services.telegram_rate_limiter import Priority
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны уведомлений: templates/notifications/<имя>.txt
+# Формат файла — заголовок, строка '---' и текст (*жирный* в звёздочках):
+#   photo: content/p24.jpg
+#   button: Подключиться | notification_24h_connect
+#   ---
+#   *Заголовок*
+#   Текст уведомления
+TEMPLATES_DIR = Path(os.getenv("NOTIFICATION_TEMPLATES_DIR", BASE_DIR / "templates" / "notifications"))
+# Как часто проверять mtime файлов шаблонов, секунды
+TEMPLATES_RELOAD_INTERVAL = float(os.getenv("NOTIFICATION_TEMPLATES_RELOAD_INTERVAL", "5"))
+
+# Рассылки пропускают вперёд сообщения об оплате и ответы пользователям
+MARKETING = {"priority": Priority.MARKETING}
+# Подтверждение оплаты обгоняет в очереди на отправку все остальные сообщения
+TRANSACTIONAL = {"priority": Priority.TRANSACTIONAL}
+
+# Лимиты Telegram (в символах UTF-16 после разбора разметки)
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+# Теги, которые Telegram принимает в parse_mode=HTML
+ALLOWED_HTML_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "a", "code", "pre", "span", "tg-spoiler", "tg-emoji", "blockquote",
+}
 
 def format_notification_text_html(text: str) -> str:
     """
@@ -12,65 +49,263 @@ def format_notification_text_html(text: str) -> str:
     formatted_text = re.sub(r'\*(.*?)\*', r'<b>\1</b>', text)
     return formatted_text
 
+
+class _TelegramHTMLChecker(HTMLParser):
+    """Проверяет теги и считает длину текста так, как её видит Telegram"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.length = 0
+        self._open: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ALLOWED_HTML_TAGS:
+            raise ValueError(f"тег <{tag}> не поддерживается Telegram")
+        self._open.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self._open or self._open[-1] != tag:
+            raise ValueError(f"лишний или незакрытый тег </{tag}>")
+        self._open.pop()
+
+    def handle_data(self, data):
+        self.length += len(data.encode("utf-16-le")) // 2
+
+    def check(self, text: str) -> int:
+        self.feed(text)
+        self.close()
+        if self._open:
+            raise ValueError(f"незакрытый тег <{self._open[-1]}>")
+        return self.length
+
+
+@dataclass(frozen=True)
+class NotificationTemplate:
+    """Готовое к отправке уведомление: общие для всех получателей текст и клавиатура"""
+    name: str
+    text: str  # HTML
+    keyboard: InlineKeyboardMarkup
+    photo_path: Optional[str]
+    # текст влезает в подпись к фото; иначе отправляем только текст
+    fits_caption: bool
+
+
+def parse_template(name: str, raw: str) -> NotificationTemplate:
+    header, sep, body = ("\n" + raw).partition("\n---\n")
+    if not sep:
+        raise ValueError("нет разделителя '---' между заголовком и текстом")
+
+    photo_path = None
+    rows = []
+    for line in header.splitlines():
+        if not line.strip():
+            continue
+        key, _, value = line.partition(":")
+        key, value = key.strip(), value.strip()
+        if key == "photo":
+            photo_path = value
+        elif key == "button":
+            label, _, callback_data = value.rpartition("|")
+            if not label.strip() or not callback_data.strip():
+                raise ValueError(f"кнопка должна быть в виде 'текст | callback_data': {value}")
+            rows.append([InlineKeyboardButton(label.strip(), callback_data=callback_data.strip())])
+        else:
+            raise ValueError(f"неизвестное поле заголовка: {key}")
+
+    text = format_notification_text_html(body.rstrip("\n"))
+    length = _TelegramHTMLChecker().check(text)
+    if length > MESSAGE_LIMIT:
+        raise ValueError(f"текст длиннее {MESSAGE_LIMIT} символов ({length})")
+    fits_caption = length <= CAPTION_LIMIT
+    if photo_path and not fits_caption:
+        logger.warning(
+            f"Шаблон {name}: текст ({length}) длиннее подписи к фото ({CAPTION_LIMIT}), "
+            f"уведомление будет отправляться без картинки"
+        )
+
+    return NotificationTemplate(
+        name=name,
+        text=text,
+        keyboard=InlineKeyboardMarkup(rows),
+        photo_path=photo_path,
+        fits_caption=fits_caption,
+    )
+
+
+class NotificationTemplates:
+    """
+    Реестр шаблонов уведомлений. Каждый файл разбирается и проверяется один раз,
+    дальше все получатели рассылки получают один и тот же объект.
+    Изменённый файл перечитывается на лету; если новая версия невалидна,
+    остаётся прежняя.
+    """
+
+    def __init__(self, directory: Path = TEMPLATES_DIR, reload_interval: float = TEMPLATES_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        # имя -> (mtime, шаблон)
+        self._templates: dict[str, tuple[float, NotificationTemplate]] = {}
+        self._checked_at: Optional[float] = None
+
+    def load(self) -> None:
+        """Загружает все шаблоны; ошибка в любом из них — исключение (вызывается при старте)"""
+        templates = {}
+        for path in sorted(self.directory.glob("*.txt")):
+            mtime = path.stat().st_mtime
+            try:
+                templates[path.stem] = (mtime, parse_template(path.stem, path.read_text(encoding="utf-8")))
+            except ValueError as e:
+                raise ValueError(f"Шаблон уведомления {path}: {e}") from e
+        self._templates = templates
+        self._checked_at = time.monotonic()
+        logger.info(f"Загружено шаблонов уведомлений: {len(templates)}")
+
+    def get(self, name: str) -> NotificationTemplate:
+        if self._checked_at is None:
+            self.load()
+        elif time.monotonic() - self._checked_at >= self.reload_interval:
+            self._reload_changed()
+        try:
+            return self._templates[name][1]
+        except KeyError:
+            raise KeyError(f"Нет шаблона уведомления '{name}' в {self.directory}") from None
+
+    def _reload_changed(self) -> None:
+        self._checked_at = time.monotonic()
+        templates = dict(self._templates)
+        for path in self.directory.glob("*.txt"):
+            try:
+                mtime = path.stat().st_mtime
+                cached = templates.get(path.stem)
+                if cached is not None and cached[0] == mtime:
+                    continue
+                templates[path.stem] = (mtime, parse_template(path.stem, path.read_text(encoding="utf-8")))
+                logger.info(f"Шаблон уведомления {path.stem} перечитан")
+            except (OSError, ValueError) as e:
+                logger.error(f"Шаблон уведомления {path} не перечитан, оставляем прежний: {e}")
+        self._templates = templates
+
+
+# Глобальный реестр шаблонов
+notification_templates = NotificationTemplates()
+
+
 def get_24h_notification_text() -> str:
     """
     Возвращает текст уведомления через 24 часа с HTML форматированием
     """
-    text = """*Ты уже задумывался о работе на маркетплейсах — и, скорее всего, не просто так.*
-Возможно, хочешь выбраться из найма. Или найти удалённый доход, чтобы быть свободнее в деньгах и месте жительства. Но, как и у многих, внутри сидит страх: *а вдруг не получится?* Вдруг солью деньги? Вдруг всё окажется слишком сложно?
-И вот в такие моменты как раз и нужен *проверенный маршрут и сообщество*, где тебя не бросят разбираться в одиночку.
-💬 В MarketSkills мы собрали систему, которая помогает зайти на маркетплейсы даже с нуля — без вложений, без «инфоцыганства», с живыми кейсами и реальной обратной связью.
-Ты не просто покупаешь подписку.
- Ты становишься частью комьюнити, где:
- — тебя обучают практики;
- — можно найти партнёров, с кем открыть бизнес;
- — а при желании — даже устроиться в команду и зарабатывать без своих вложений.
-🚀Всё это уже работает — и каждый день в чате появляются новые истории запусков.
-Если внутри тебя до сих пор есть отклик — возвращайся.
-👇 Кнопка ниже — и ты с нами:"""
-    
-    return format_notification_text_html(text)
+    return notification_templates.get("24h").text
 
 def get_24h_notification_photo_path() -> str:
     """
     Возвращает путь к картинке для 24-часового уведомления
     """
-    return "content/p24.jpg"
+    return notification_templates.get("24h").photo_path
 
 def get_24h_notification_keyboard() -> InlineKeyboardMarkup:
     """
     Возвращает клавиатуру для уведомления через 24 часа
     """
-    keyboard = [[InlineKeyboardButton("Подключиться", callback_data='notification_24h_connect')]]
-    return InlineKeyboardMarkup(keyboard)
+    return notification_templates.get("24h").keyboard
 
 def get_48h_notification_text() -> str:
     """
     Возвращает текст уведомления через 48 часов
     """
-    text = """*ЧТО У НАС ПРОИЗОШЛО ЗА ПОСЛЕДНИЕ 2 НЕДЕЛИ В MARKETSKILLS:*
-💥 К нам присоединились уже *100+ участников*, и с каждым днём комьюнити становится сильнее — ребята запускают магазины, работаю, делятся фишками, помогают друг другу и растут вместе.
-📦 Несколько подписчиков *открыли свои первые магазины* по партнёрской модели — без вложений, без опыта, но с правильной системой.
-📊 Провели *закрытый разбор ниши*, где показали, как найти товар с маржой от 1000₽ и конкуренцией ниже 3к продавцов. Такие штуки в интернете просто так не найти.
-🛠 Внедрили *новые разделы в канале* — теперь всё структурировано: обучение, шаблоны, готовые товары, поддержка.
-🧠 Запускаем работу с *нейросетями*, что позволяет лежа на диване с помощью двух нажатий выполнять многочасовые работы и получать деньги
-🎙 А ещё выходит *подкаст внутри сообщества* — делимся мыслями, кейсами и отвечаем на ваши вопросы. Без фильтров.
-📌 И да, *ты ничего не пропустил* — всё в записи, можешь подключиться в любой момент и начать с удобной точки.
-Это только начало.
-*Хочешь быть не наблюдателем, а участником?*
- Жми на кнопку и заходи — мы тебя ждём👇"""
-    
-    return format_notification_text_html(text)
+    return notification_templates.get("48h").text
 
 def get_48h_notification_photo_path() -> str:
     """
     Возвращает путь к картинке для 48-часового уведомления
     """
-    return "content/p48.jpg"
+    return notification_templates.get("48h").photo_path
 
 def get_48h_notification_keyboard() -> InlineKeyboardMarkup:
     """
     Возвращает клавиатуру для уведомления через 48 часов
     """
-    keyboard = [[InlineKeyboardButton("Вступить в команду!", callback_data='notification_48h_connect')]]
-    return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
+    return notification_templates.get("48h").keyboard
+
+async def send_followup_notification(bot: Bot, chat_id: int, notification_type: str) -> None:
+    """
+    Отправляет 24ч/48ч уведомление: картинка с текстом и кнопкой,
+    при ошибке отправки картинки — только текст.
+    Forbidden (пользователь заблокировал бота) и RetryAfter (лимит Telegram исчерпан
+    и после повторов) пробрасываются вызывающему — запасной текст только удвоил бы нагрузку.
+    """
+    template = notification_templates.get(notification_type)
+
+    if template.photo_path and template.fits_caption:
+        try:
+            await media_assets.send_photo(
+                bot,
+                chat_id,
+                template.photo_path,
+                caption=template.text,
+                parse_mode=ParseMode.HTML,
+                reply_markup=template.keyboard,
+                rate_limit_args=MARKETING,
+            )
+            return
+        except (Forbidden, RetryAfter):
+            raise
+        except Exception as e:
+            logger.error(f"Error sending {notification_type} photo to {chat_id}, fallback to text: {e}")
+
+    await bot.send_message(
+        chat_id=chat_id,
+        text=template.text,
+        parse_mode=ParseMode.HTML,
+        reply_markup=template.keyboard,
+        rate_limit_args=MARKETING,
+    )
+
+PAYMENT_SUCCEEDED_TEXT = """Оплата прошла успешно!
+
+Добро пожаловать в МаркетСкиллс. Закреп этого бота чтобы не потерять, здесь будут лучшие предложения для участие в клубе. Подключайся👇🏻"""
+PAYMENT_SUCCEEDED_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("Подключиться", url="https://t.me/+894eFO0WhbhjZTUy")]])
+PAYMENT_SUCCEEDED_PHOTO = "content/photo4.jpg"
+
+async def send_payment_succeeded_notification(bot: Bot, chat_id: int) -> None:
+    """
+    Сообщение об успешной оплате со ссылкой на вступление: картинка с текстом,
+    при ошибке отправки картинки — только текст.
+    Forbidden и RetryAfter пробрасываются вызывающему.
+    """
+    try:
+        # Файл загружается в Telegram один раз, дальше отправляем по file_id
+        await media_assets.send_photo(
+            bot,
+            chat_id,
+            PAYMENT_SUCCEEDED_PHOTO,
+            caption=PAYMENT_SUCCEEDED_TEXT,
+            reply_markup=PAYMENT_SUCCEEDED_KEYBOARD,
+            rate_limit_args=TRANSACTIONAL,
+        )
+        return
+    except (Forbidden, RetryAfter):
+        raise
+    except Exception as e:
+        logger.error(f"Error sending payment photo to {chat_id}, fallback to text: {e}")
+
+    await bot.send_message(
+        chat_id=chat_id,
+        text=PAYMENT_SUCCEEDED_TEXT,
+        reply_markup=PAYMENT_SUCCEEDED_KEYBOARD,
+        rate_limit_args=TRANSACTIONAL,
+    )
+
+SUBSCRIPTION_ENDED_TEXT = """<b>Твоя подписка MarketSkills закончилась</b> 😔
+
+Доступ к урокам, эфирам и чату закрыт. Продли подписку — и продолжай с того места, где остановился 👇"""
+SUBSCRIPTION_ENDED_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("Продлить подписку", callback_data='proceed_to_payment')]])
+
+async def send_subscription_ended_notification(bot: Bot, chat_id: int) -> None:
+    """Сообщение об окончании подписки с кнопкой продления (кладёт в outbox services/subscription_expiry.py)"""
+    await bot.send_message(
+        chat_id=chat_id,
+        text=SUBSCRIPTION_ENDED_TEXT,
+        parse_mode=ParseMode.HTML,
+        reply_markup=SUBSCRIPTION_ENDED_KEYBOARD,
+        rate_limit_args=MARKETING,
+    )
@@ -0,0 +1,198 @@
+# services/outbox.py
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram import Bot
+from telegram.error import Forbidden
+
+from db import get_session
+from models import OutboxMessage
+from services.n8n_service import n8n_service
+from services.notification_service import send_payment_succeeded_notification, send_subscription_ended_notification
+
+logger = logging.getLogger(__name__)
+
+# Темы сообщений: "<транспорт>.<тип>"
+TELEGRAM_PAYMENT_SUCCEEDED = "telegram.payment_succeeded"
+TELEGRAM_SUBSCRIPTION_ENDED = "telegram.subscription_ended"
+N8N_PAYMENT_CREATED_24H = "n8n.payment_created_24h"
+N8N_PAYMENT_CREATED_48H = "n8n.payment_created_48h"
+
+
+class OutboxSkip(Exception):
+    """Сообщение доставлять не нужно (получатель заблокировал бота, транспорт не настроен)"""
+
+
+def add_outbox_message(session: AsyncSession, topic: str, payload: dict) -> OutboxMessage:
+    """
+    Добавляет сообщение в outbox текущей транзакции: оно будет отправлено,
+    только если транзакция закоммитится, и переживёт падение процесса после commit.
+    """
+    now = datetime.now(timezone.utc)
+    message = OutboxMessage(topic=topic, payload=payload, attempts=0, next_attempt_at=now, created_at=now)
+    session.add(message)
+    return message
+
+
+async def claim_outbox_batch(session: AsyncSession, limit: int, lease: timedelta) -> list[OutboxMessage]:
+    """
+    Забирает пачку сообщений, у которых подошло время попытки, и откладывает их на lease:
+    если relay упадёт посреди отправки, сообщения вернутся в очередь (at-least-once).
+    """
+    now = datetime.now(timezone.utc)
+    due_ids = (
+        select(OutboxMessage.id)
+        .where(OutboxMessage.sent_at.is_(None), OutboxMessage.next_attempt_at <= now)
+        .order_by(OutboxMessage.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(due_ids))
+        .values(attempts=OutboxMessage.attempts + 1, next_attempt_at=now + lease)
+        .returning(OutboxMessage)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars())
+
+
+# ------------------ Транспорты ------------------
+def _telegram(send: Callable[[Bot, int], Awaitable[None]]):
+    async def deliver(bot: Bot, payload: dict) -> None:
+        try:
+            await send(bot, int(payload["chat_id"]))
+        except Forbidden:
+            raise OutboxSkip(f"user {payload['chat_id']} blocked the bot")
+    return deliver
+
+
+def _n8n_payment_created(send: Callable[..., Awaitable[bool]], url_attr: str):
+    async def deliver(bot: Bot, payload: dict) -> None:
+        if not getattr(n8n_service, url_attr):
+            raise OutboxSkip(f"{url_attr} не настроен")
+        # методы N8NService сами логируют ошибку и возвращают False
+        if not await send(**payload):
+            raise RuntimeError("N8N не принял событие")
+    return deliver
+
+
+TRANSPORTS: dict[str, Callable[[Bot, dict], Awaitable[Any]]] = {
+    TELEGRAM_PAYMENT_SUCCEEDED: _telegram(send_payment_succeeded_notification),
+    TELEGRAM_SUBSCRIPTION_ENDED: _telegram(send_subscription_ended_notification),
+    N8N_PAYMENT_CREATED_24H: _n8n_payment_created(n8n_service.send_payment_created_notification, "webhook_url_24h"),
+    N8N_PAYMENT_CREATED_48H: _n8n_payment_created(n8n_service.send_48h_payment_created_notification, "webhook_url_48h"),
+}
+
+
+class OutboxRelay:
+    """
+    Разбирает таблицу outbox пачками и доставляет сообщения транспортам (Telegram, N8N).
+    Несколько процессов могут работать одновременно — пачки не пересекаются (SKIP LOCKED).
+    Ошибка доставки откладывает только это сообщение с экспоненциальной задержкой.
+    """
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+        self.concurrency = int(os.getenv("OUTBOX_SEND_CONCURRENCY", "20"))
+        self.poll_interval = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+        self.max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+        self.lease = timedelta(seconds=float(os.getenv("OUTBOX_LEASE", "120")))
+        self.retry_base = float(os.getenv("OUTBOX_RETRY_BASE", "5"))
+        self.retry_max = float(os.getenv("OUTBOX_RETRY_MAX", "1800"))
+        self._bot: Optional[Bot] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, bot: Bot) -> None:
+        self._bot = bot
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self) -> None:
+        """В outbox закоммичены новые сообщения — не ждём poll_interval"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _loop(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await self.relay_batch()
+            except Exception as e:
+                logger.warning(f"Ошибка разбора outbox: {e}")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue  # очередь ещё не разобрана
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def relay_batch(self) -> int:
+        async with get_session() as session:
+            messages = await claim_outbox_batch(session, self.batch_size, self.lease)
+            await session.commit()
+        if not messages:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(message: OutboxMessage) -> Optional[Exception]:
+            transport = TRANSPORTS.get(message.topic)
+            if transport is None:
+                return LookupError(f"Нет транспорта для темы {message.topic}")
+            async with semaphore:
+                try:
+                    await transport(self._bot, message.payload or {})
+                except OutboxSkip as e:
+                    logger.info(f"Outbox {message.id} ({message.topic}) пропущено: {e}")
+                except Exception as e:
+                    return e
+            return None
+
+        results = await asyncio.gather(*(deliver(m) for m in messages))
+
+        now = datetime.now(timezone.utc)
+        delivered = [m.id for m, error in zip(messages, results) if error is None]
+        async with get_session() as session:
+            if delivered:
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(delivered))
+                    .values(sent_at=now, last_error=None)
+                )
+            for message, error in zip(messages, results):
+                if error is not None:
+                    await session.execute(
+                        update(OutboxMessage)
+                        .where(OutboxMessage.id == message.id)
+                        .values(next_attempt_at=self._next_attempt(message, now), last_error=str(error)[:2000])
+                    )
+            await session.commit()
+        return len(messages)
+
+    def _next_attempt(self, message: OutboxMessage, now: datetime) -> Optional[datetime]:
+        if message.attempts >= self.max_attempts:
+            logger.error(f"Outbox {message.id} ({message.topic}): попытки исчерпаны, нужен ручной разбор")
+            return None
+        delay = min(self.retry_base * 2 ** (message.attempts - 1), self.retry_max)
+        logger.warning(f"Outbox {message.id} ({message.topic}): повтор через {delay:.0f} с")
+        return now + timedelta(seconds=delay)
+
+
+# Глобальный экземпляр relay
+outbox_relay = OutboxRelay()
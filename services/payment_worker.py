@@ -0,0 +1,228 @@
+# services/payment_worker.py
+import os
+import asyncio
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import get_session
+from models import WebhookInbox
+from services.subscriptions import (
+    mark_payment_succeeded,
+    activate_or_extend_subscription,
+    record_payment_event,
+)
+from services.outbox import outbox_relay, add_outbox_message, TELEGRAM_PAYMENT_SUCCEEDED
+from services.metrics import PAYMENT_EVENT_LATENCY
+from services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+async def is_webhook_event_queued(session: AsyncSession, event_key: str) -> bool:
+    """Быстрая проверка дубля: один поиск по уникальному индексу event_key, без записи"""
+    return await session.scalar(
+        select(WebhookInbox.id).where(WebhookInbox.event_key == event_key).limit(1)
+    ) is not None
+
+
+async def enqueue_webhook_event(session: AsyncSession, event_key: str, event: str, payload: dict) -> bool:
+    """
+    Сохраняет событие ЮKassa в webhook_inbox. False — такое событие уже в очереди
+    (параллельная повторная доставка, не пойманная is_webhook_event_queued),
+    второй раз его не обрабатываем.
+    """
+    inbox_id = await session.scalar(
+        pg_insert(WebhookInbox)
+        .values(
+            event_key=event_key,
+            event=event,
+            payload=payload,
+            attempts=0,
+            next_attempt_at=datetime.now(timezone.utc),
+            created_at=datetime.now(timezone.utc),
+        )
+        .on_conflict_do_nothing(index_elements=[WebhookInbox.event_key])
+        .returning(WebhookInbox.id)
+    )
+    return inbox_id is not None
+
+
+async def claim_webhook_event(session: AsyncSession, lease: timedelta) -> Optional[WebhookInbox]:
+    """
+    Забирает одно событие, у которого подошло время попытки, и откладывает его
+    на lease: если воркер упадёт посреди обработки, событие вернётся в очередь.
+    SKIP LOCKED позволяет нескольким воркерам и экземплярам сервиса не мешать друг другу.
+    """
+    now = datetime.now(timezone.utc)
+    due_id = (
+        select(WebhookInbox.id)
+        .where(WebhookInbox.processed_at.is_(None), WebhookInbox.next_attempt_at <= now)
+        .order_by(WebhookInbox.next_attempt_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(WebhookInbox)
+        .where(WebhookInbox.id == due_id)
+        .values(attempts=WebhookInbox.attempts + 1, next_attempt_at=now + lease)
+        .returning(WebhookInbox)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
+
+
+class PaymentEventWorker:
+    """
+    Пул воркеров, обрабатывающих события из webhook_inbox: транзакция в БД
+    (платёж + подписка + сообщение пользователю в outbox). Вебхук ЮKassa только
+    кладёт событие в очередь и сразу отвечает 200.
+
+    Ошибка — повтор с экспоненциальной задержкой; после max_attempts событие
+    остаётся в таблице с last_error и next_attempt_at = NULL.
+    """
+
+    def __init__(self):
+        self.concurrency = int(os.getenv("PAYMENT_WORKER_CONCURRENCY", "4"))
+        self.poll_interval = float(os.getenv("PAYMENT_WORKER_POLL_INTERVAL", "5"))
+        self.max_attempts = int(os.getenv("PAYMENT_WORKER_MAX_ATTEMPTS", "8"))
+        self.lease = timedelta(seconds=float(os.getenv("PAYMENT_WORKER_LEASE", "120")))
+        self.retry_base = float(os.getenv("PAYMENT_WORKER_RETRY_BASE", "5"))
+        self.retry_max = float(os.getenv("PAYMENT_WORKER_RETRY_MAX", "600"))
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Новое событие в очереди — будим воркеры, не дожидаясь poll_interval"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with get_session() as session:
+                    item = await claim_webhook_event(session, self.lease)
+                    await session.commit()
+            except Exception as e:
+                logger.warning(f"Не удалось забрать событие из webhook_inbox: {e}")
+                item = None
+
+            if item is not None:
+                await self._handle(item)
+                continue
+
+            # очередь пуста: ждём нового события или следующего опроса (повторы, другие экземпляры)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _handle(self, item: WebhookInbox) -> None:
+        started = time.perf_counter()
+        try:
+            await self.process(item)
+        except Exception as e:
+            PAYMENT_EVENT_LATENCY.observe(time.perf_counter() - started, "error")
+            logger.exception(f"Событие {item.event_key} не обработано (попытка {item.attempts})")
+            await self._schedule_retry(item, e)
+        else:
+            PAYMENT_EVENT_LATENCY.observe(time.perf_counter() - started, "ok")
+
+    async def process(self, item: WebhookInbox) -> None:
+        """
+        Платёж succeeded + продление подписки + сообщение пользователю в outbox —
+        одной транзакцией вместе с отметкой processed_at. Сообщение отправит outbox_relay.
+        """
+        payload = item.payload or {}
+        metadata = payload.get("metadata") or {}
+        payment_db_id = int(metadata["payment_db_id"])
+
+        # trace_id из metadata платежа: та же трасса, что клик по тарифу и вебхук
+        with tracer.trace("payment_worker.process", trace_id=metadata.get("trace_id"), attempt=item.attempts):
+            async with get_session() as session:
+                # payment_events — журнал применённых событий; гонку двух обработок решает БД
+                with tracer.span("payment_events.record"):
+                    applied = await record_payment_event(
+                        session,
+                        payment_db_id=payment_db_id,
+                        event=item.event,
+                        event_key=item.event_key,
+                        payload=payload,
+                    )
+                if applied:
+                    # Обновляем запись платежа: succeeded + paid_at + provider_payment_id + сырой payload
+                    with tracer.span("payments.mark_succeeded"):
+                        payment = await mark_payment_succeeded(
+                            session=session,
+                            payment_db_id=payment_db_id,
+                            provider_payment_id=payload.get("id") or "",
+                            payload=payload,
+                        )
+                    # Активируем/продлеваем подписку пользователю по тарифу из платежа
+                    with tracer.span("subscriptions.activate_or_extend"):
+                        sub = await activate_or_extend_subscription(
+                            session=session,
+                            user_id=payment.user_id,
+                            tariff_code=payment.tariff_code,
+                        )
+                    chat_id = metadata.get("chat_id")
+                    if chat_id:
+                        add_outbox_message(session, TELEGRAM_PAYMENT_SUCCEEDED, {"chat_id": int(chat_id)})
+                    logger.info(
+                        f"Payment {payment.id} marked as succeeded; "
+                        f"subscription end_at={sub.end_at:%Y-%m-%d %H:%M} user_id={payment.user_id}"
+                    )
+                else:
+                    logger.info(f"[YK] event {item.event_key} already applied, skipping")
+
+                await session.execute(
+                    update(WebhookInbox)
+                    .where(WebhookInbox.id == item.id)
+                    .values(processed_at=datetime.now(timezone.utc), last_error=None)
+                )
+                with tracer.span("commit"):
+                    await session.commit()
+
+        outbox_relay.notify()
+
+    async def _schedule_retry(self, item: WebhookInbox, error: Exception) -> None:
+        if item.attempts >= self.max_attempts:
+            next_attempt_at = None
+            logger.error(f"Событие {item.event_key}: попытки исчерпаны ({item.attempts}), нужен ручной разбор")
+        else:
+            delay = min(self.retry_base * 2 ** (item.attempts - 1), self.retry_max)
+            next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        try:
+            async with get_session() as session:
+                await session.execute(
+                    update(WebhookInbox)
+                    .where(WebhookInbox.id == item.id)
+                    .values(next_attempt_at=next_attempt_at, last_error=str(error)[:2000])
+                )
+                await session.commit()
+        except Exception as e:
+            # не записали — событие вернётся в очередь по истечении lease
+            logger.warning(f"Не удалось запланировать повтор события {item.event_key}: {e}")
+
+
+# Глобальный экземпляр пула воркеров
+payment_worker = PaymentEventWorker()
@@ -0,0 +1,58 @@
+# services/reminders.py
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Payment, PaymentStatus, PaymentReminder
+
+PAYMENT_REMINDER_DELAY = timedelta(minutes=15)
+
+async def schedule_payment_reminder(
+    session: AsyncSession,
+    payment_id: int,
+    chat_id: int,
+    delay: timedelta = PAYMENT_REMINDER_DELAY,
+) -> PaymentReminder:
+    reminder = PaymentReminder(
+        payment_id=payment_id,
+        chat_id=chat_id,
+        due_at=datetime.now(timezone.utc) + delay,
+    )
+    session.add(reminder)
+    await session.flush()
+    return reminder
+
+async def claim_due_reminders(session: AsyncSession, limit: int = 200) -> tuple[int, list[tuple[int, int]]]:
+    """
+    Атомарно помечает пачку наступивших напоминаний как отправленные и возвращает
+    (сколько напоминаний забрано, [(payment_id, chat_id)] только по неоплаченным платежам).
+    По первому числу вызывающий понимает, разобрана ли очередь: оплаченные платежи
+    в пачке уменьшают список к отправке, но не число забранных строк.
+    SKIP LOCKED позволяет нескольким экземплярам бота разбирать очередь без дублей.
+    """
+    now = datetime.now(timezone.utc)
+    due_ids = (
+        select(PaymentReminder.id)
+        .where(PaymentReminder.fired_at.is_(None), PaymentReminder.due_at <= now)
+        .order_by(PaymentReminder.due_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(PaymentReminder)
+        .where(PaymentReminder.id.in_(due_ids))
+        .values(fired_at=now)
+        .returning(PaymentReminder.payment_id, PaymentReminder.chat_id)
+    )
+    claimed = result.all()
+    if not claimed:
+        return 0, []
+
+    # Оплаченные платежи пропускаем одним запросом на всю пачку
+    paid_ids = set(await session.scalars(
+        select(Payment.id).where(
+            Payment.id.in_([row.payment_id for row in claimed]),
+            Payment.status == PaymentStatus.succeeded,
+        )
+    ))
+    return len(claimed), [(row.payment_id, row.chat_id) for row in claimed if row.payment_id not in paid_ids]
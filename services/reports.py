@@ -0,0 +1,252 @@
+# services/reports.py
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.funnel import FUNNEL_STEPS
+
+# Часовой пояс, в котором считаются «дни» отчётов (и таблицы daily_payment_stats)
+REPORTS_TZ = os.getenv("REPORTS_TZ", "Europe/Moscow")
+
+
+@dataclass
+class ReportResult:
+    columns: list[str]
+    rows: list[tuple]
+
+    def as_dicts(self) -> list[dict[str, Any]]:
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+
+@dataclass(frozen=True)
+class ReportParams:
+    since: date
+    until: date  # не включительно
+    tz: str = REPORTS_TZ
+    # брать дневные агрегаты из daily_payment_stats вместо сканирования payments
+    from_rollup: bool = False
+
+    @property
+    def binds(self) -> dict[str, Any]:
+        return {"since": self.since, "until": self.until, "tz": self.tz}
+
+
+async def _run(session: AsyncSession, sql: str, params: ReportParams) -> ReportResult:
+    result = await session.execute(text(sql), params.binds)
+    return ReportResult(columns=list(result.keys()), rows=[tuple(row) for row in result.all()])
+
+
+# ------------------ Выручка по дням и тарифам ------------------
+REVENUE_SQL = """
+WITH daily AS (
+    SELECT (paid_at AT TIME ZONE :tz)::date AS day,
+           tariff_code,
+           count(*)                       AS payments,
+           sum(amount_rub)                AS revenue
+    FROM payments
+    WHERE status = 'succeeded'
+      AND paid_at >= (CAST(:since AS date)::timestamp AT TIME ZONE :tz)
+      AND paid_at <  (CAST(:until AS date)::timestamp AT TIME ZONE :tz)
+    GROUP BY 1, 2
+)
+SELECT day,
+       tariff_code,
+       payments,
+       revenue,
+       sum(revenue) OVER (PARTITION BY tariff_code ORDER BY day)            AS revenue_cumulative,
+       round(100.0 * revenue / sum(revenue) OVER (PARTITION BY day), 1)     AS share_of_day_pct
+FROM daily
+ORDER BY day, tariff_code
+"""
+
+REVENUE_ROLLUP_SQL = """
+SELECT day,
+       tariff_code,
+       paid                                                                 AS payments,
+       revenue,
+       sum(revenue) OVER (PARTITION BY tariff_code ORDER BY day)            AS revenue_cumulative,
+       round(100.0 * revenue / nullif(sum(revenue) OVER (PARTITION BY day), 0), 1) AS share_of_day_pct
+FROM daily_payment_stats
+WHERE day >= :since AND day < :until AND paid > 0
+ORDER BY day, tariff_code
+"""
+
+
+async def revenue_report(session: AsyncSession, params: ReportParams) -> ReportResult:
+    return await _run(session, REVENUE_ROLLUP_SQL if params.from_rollup else REVENUE_SQL, params)
+
+
+# ------------------ Конверсия pending -> succeeded ------------------
+# Когорта — платежи, созданные в этот день: сколько из них в итоге оплачено
+CONVERSION_SQL = """
+SELECT (created_at AT TIME ZONE :tz)::date                                  AS day,
+       tariff_code,
+       count(*)                                                             AS created,
+       count(*) FILTER (WHERE status = 'succeeded')                         AS succeeded,
+       round(100.0 * count(*) FILTER (WHERE status = 'succeeded') / count(*), 1) AS conversion_pct
+FROM payments
+WHERE created_at >= (CAST(:since AS date)::timestamp AT TIME ZONE :tz)
+  AND created_at <  (CAST(:until AS date)::timestamp AT TIME ZONE :tz)
+GROUP BY 1, 2
+ORDER BY 1, 2
+"""
+
+CONVERSION_ROLLUP_SQL = """
+SELECT day,
+       tariff_code,
+       created,
+       created_succeeded                                                    AS succeeded,
+       round(100.0 * created_succeeded / nullif(created, 0), 1)             AS conversion_pct
+FROM daily_payment_stats
+WHERE day >= :since AND day < :until AND created > 0
+ORDER BY day, tariff_code
+"""
+
+
+async def conversion_report(session: AsyncSession, params: ReportParams) -> ReportResult:
+    return await _run(session, CONVERSION_ROLLUP_SQL if params.from_rollup else CONVERSION_SQL, params)
+
+
+# ------------------ Время от создания платежа до оплаты ------------------
+# Перцентили и доля оплат, уложившихся в порог, по тарифам и в целом (ROLLUP)
+TIME_TO_PAY_SQL = """
+WITH paid AS (
+    SELECT tariff_code,
+           extract(epoch FROM paid_at - created_at) / 60 AS minutes
+    FROM payments
+    WHERE status = 'succeeded'
+      AND paid_at IS NOT NULL
+      AND created_at >= (CAST(:since AS date)::timestamp AT TIME ZONE :tz)
+      AND created_at <  (CAST(:until AS date)::timestamp AT TIME ZONE :tz)
+)
+SELECT coalesce(tariff_code, 'ВСЕГО')                                       AS tariff_code,
+       count(*)                                                             AS payments,
+       round(percentile_cont(0.5)  WITHIN GROUP (ORDER BY minutes)::numeric, 1) AS p50_min,
+       round(percentile_cont(0.9)  WITHIN GROUP (ORDER BY minutes)::numeric, 1) AS p90_min,
+       round(percentile_cont(0.99) WITHIN GROUP (ORDER BY minutes)::numeric, 1) AS p99_min,
+       round(100.0 * count(*) FILTER (WHERE minutes < 5)    / count(*), 1)  AS within_5m_pct,
+       round(100.0 * count(*) FILTER (WHERE minutes < 15)   / count(*), 1)  AS within_15m_pct,
+       round(100.0 * count(*) FILTER (WHERE minutes < 60)   / count(*), 1)  AS within_1h_pct,
+       round(100.0 * count(*) FILTER (WHERE minutes < 1440) / count(*), 1)  AS within_24h_pct
+FROM paid
+GROUP BY ROLLUP (tariff_code)
+ORDER BY grouping(tariff_code), tariff_code
+"""
+
+
+async def time_to_pay_report(session: AsyncSession, params: ReportParams) -> ReportResult:
+    return await _run(session, TIME_TO_PAY_SQL, params)
+
+
+# ------------------ Активные подписчики ------------------
+ACTIVE_SUBSCRIBERS_SQL = """
+SELECT coalesce(tariff_code, 'ВСЕГО')                                       AS tariff_code,
+       count(DISTINCT user_id)                                              AS subscribers,
+       count(*) FILTER (WHERE end_at < (now() AT TIME ZONE 'UTC') + interval '7 days') AS ending_within_7d
+FROM subscriptions
+WHERE status = 'active'
+  AND end_at >= now() AT TIME ZONE 'UTC'
+GROUP BY ROLLUP (tariff_code)
+ORDER BY grouping(tariff_code), tariff_code
+"""
+
+
+async def active_subscribers_report(session: AsyncSession, params: ReportParams) -> ReportResult:
+    return await _run(session, ACTIVE_SUBSCRIBERS_SQL, params)
+
+
+# ------------------ Воронка по шагам ------------------
+# Уникальные пользователи на каждом шаге за период и конверсия от предыдущего и от первого шага
+FUNNEL_SQL = """
+WITH steps (step, position) AS (
+    VALUES %s
+),
+reached AS (
+    SELECT step, count(DISTINCT telegram_id) AS users, count(*) AS events
+    FROM funnel_events
+    WHERE created_at >= (CAST(:since AS date)::timestamp AT TIME ZONE :tz)
+      AND created_at <  (CAST(:until AS date)::timestamp AT TIME ZONE :tz)
+    GROUP BY step
+)
+SELECT s.position,
+       s.step,
+       coalesce(r.users, 0)                                                 AS users,
+       coalesce(r.events, 0)                                                AS events,
+       round(100.0 * coalesce(r.users, 0)
+             / nullif(lag(coalesce(r.users, 0)) OVER w, 0), 1)              AS from_previous_pct,
+       round(100.0 * coalesce(r.users, 0)
+             / nullif(first_value(coalesce(r.users, 0)) OVER w, 0), 1)      AS from_first_pct
+FROM steps s
+LEFT JOIN reached r USING (step)
+WINDOW w AS (ORDER BY s.position)
+ORDER BY s.position
+""" % ", ".join(f"('{step}', {position})" for position, step in enumerate(FUNNEL_STEPS, start=1))
+
+
+async def funnel_report(session: AsyncSession, params: ReportParams) -> ReportResult:
+    return await _run(session, FUNNEL_SQL, params)
+
+
+REPORTS: dict[str, Callable[[AsyncSession, ReportParams], Awaitable[ReportResult]]] = {
+    "revenue": revenue_report,
+    "conversion": conversion_report,
+    "time_to_pay": time_to_pay_report,
+    "active_subscribers": active_subscribers_report,
+    "funnel": funnel_report,
+}
+
+
+# ------------------ Инкрементальное обновление daily_payment_stats ------------------
+# Пересчитываются только дни, которые могли измениться: дни оплат с :since и
+# дни создания платежей, созданных или оплаченных с :since (оплата вчерашнего
+# платежа меняет конверсию вчерашней когорты). Старые дни не пересчитываются.
+REFRESH_PAID_SQL = """
+INSERT INTO daily_payment_stats (day, tariff_code, paid, revenue, refreshed_at)
+SELECT (paid_at AT TIME ZONE :tz)::date, tariff_code, count(*), sum(amount_rub), now()
+FROM payments
+WHERE status = 'succeeded'
+  AND paid_at >= (CAST(:since AS date)::timestamp AT TIME ZONE :tz)
+GROUP BY 1, 2
+ON CONFLICT (day, tariff_code) DO UPDATE SET
+    paid = excluded.paid,
+    revenue = excluded.revenue,
+    refreshed_at = excluded.refreshed_at
+"""
+
+REFRESH_CREATED_SQL = """
+WITH touched AS (
+    SELECT (created_at AT TIME ZONE :tz)::date AS day
+    FROM payments
+    WHERE created_at >= (CAST(:since AS date)::timestamp AT TIME ZONE :tz)
+    UNION
+    SELECT (created_at AT TIME ZONE :tz)::date
+    FROM payments
+    WHERE status = 'succeeded'
+      AND paid_at >= (CAST(:since AS date)::timestamp AT TIME ZONE :tz)
+)
+INSERT INTO daily_payment_stats (day, tariff_code, created, created_succeeded, refreshed_at)
+SELECT t.day, p.tariff_code, count(*), count(*) FILTER (WHERE p.status = 'succeeded'), now()
+FROM touched t
+JOIN payments p
+  ON p.created_at >= (t.day::timestamp AT TIME ZONE :tz)
+ AND p.created_at <  ((t.day + 1)::timestamp AT TIME ZONE :tz)
+GROUP BY 1, 2
+ON CONFLICT (day, tariff_code) DO UPDATE SET
+    created = excluded.created,
+    created_succeeded = excluded.created_succeeded,
+    refreshed_at = excluded.refreshed_at
+"""
+
+
+async def refresh_daily_stats(session: AsyncSession, days: int = 3, tz: str = REPORTS_TZ) -> int:
+    """Пересчитывает daily_payment_stats за последние days дней, возвращает число обновлённых строк"""
+    today = datetime.now(ZoneInfo(tz)).date()
+    binds = {"since": today - timedelta(days=days - 1), "tz": tz}
+    paid = await session.execute(text(REFRESH_PAID_SQL), binds)
+    created = await session.execute(text(REFRESH_CREATED_SQL), binds)
+    return paid.rowcount + created.rowcount
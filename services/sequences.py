@@ -0,0 +1,215 @@
+# services/sequences.py
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import Forbidden, RetryAfter
+
+from services.media_assets import media_assets
+
+logger = logging.getLogger(__name__)
+
+# Текст можно задать строкой или функцией (например, если в нём цена из справочника тарифов)
+TextSource = Union[str, Callable[[], str]]
+
+
+def _resolve(text: Optional[TextSource]) -> Optional[str]:
+    return text() if callable(text) else text
+
+
+# ------------------ Шаги ------------------
+@dataclass(frozen=True)
+class VideoNoteStep:
+    path: str
+    delay: float = 0  # пауза перед шагом, секунды
+
+
+@dataclass(frozen=True)
+class PhotoStep:
+    path: str
+    caption: Optional[TextSource] = None
+    parse_mode: Optional[str] = None
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    delay: float = 0
+    # текст вместо фото без подписи, если фото не отправилось
+    fallback_text: Optional[TextSource] = None
+
+
+@dataclass(frozen=True)
+class TextStep:
+    text: TextSource
+    parse_mode: Optional[str] = None
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    disable_web_page_preview: Optional[bool] = None
+    delay: float = 0
+
+
+Step = Union[VideoNoteStep, PhotoStep, TextStep]
+
+
+@dataclass(frozen=True)
+class MessageSequence:
+    """Упорядоченный список шагов с паузами между ними"""
+    name: str
+    steps: tuple[Step, ...]
+
+
+async def send_step(bot: Bot, chat_id: int, step: Step) -> None:
+    if isinstance(step, VideoNoteStep):
+        await media_assets.send_video_note(bot, chat_id, step.path)
+
+    elif isinstance(step, PhotoStep):
+        caption = _resolve(step.caption)
+        try:
+            await media_assets.send_photo(
+                bot,
+                chat_id,
+                step.path,
+                caption=caption,
+                parse_mode=step.parse_mode,
+                reply_markup=step.reply_markup,
+            )
+        except (Forbidden, RetryAfter):
+            raise
+        except Exception as e:
+            text = caption or _resolve(step.fallback_text)
+            if not text:
+                raise
+            logger.warning(f"Не удалось отправить фото {step.path}: {e}")
+            await bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                parse_mode=step.parse_mode,
+                reply_markup=step.reply_markup,
+            )
+
+    else:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=_resolve(step.text),
+            parse_mode=step.parse_mode,
+            reply_markup=step.reply_markup,
+            disable_web_page_preview=step.disable_web_page_preview,
+        )
+
+
+# ------------------ Планировщик ------------------
+@dataclass(eq=False)
+class _Run:
+    chat_id: int
+    sequence: MessageSequence
+    index: int = 0
+    cancelled: bool = field(default=False)
+
+
+class SequenceRunner:
+    """
+    Выполняет последовательности сообщений без корутины, «спящей» на каждого пользователя:
+    все ожидающие шаги лежат в одной куче по времени, один фоновый цикл будит
+    ближайший и отправляет его короткой задачей. Последовательность чата можно отменить.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, _Run]] = []
+        self._counter = itertools.count()
+        # chat_id -> {имя последовательности: запуск}
+        self._active: dict[int, dict[str, _Run]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # отправки, идущие прямо сейчас (ссылки держим, чтобы задачи не собрал GC)
+        self._sending: set[asyncio.Task] = set()
+        self._bot: Optional[Bot] = None
+
+    async def start(self, bot: Bot) -> None:
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._heap.clear()
+        self._active.clear()
+
+    def schedule(self, chat_id: int, sequence: MessageSequence) -> None:
+        """Запускает последовательность для чата; такая же незавершённая отменяется"""
+        self._cancel_run(self._active.get(chat_id, {}).get(sequence.name))
+        run = _Run(chat_id=chat_id, sequence=sequence)
+        self._active.setdefault(chat_id, {})[sequence.name] = run
+        self._push(run)
+
+    def cancel(self, chat_id: int, name: Optional[str] = None) -> None:
+        """Отменяет оставшиеся шаги последовательности (или всех последовательностей) чата"""
+        runs = self._active.get(chat_id)
+        if not runs:
+            return
+        for run in list(runs.values()) if name is None else [runs.get(name)]:
+            self._cancel_run(run)
+
+    def _cancel_run(self, run: Optional[_Run]) -> None:
+        if run is None:
+            return
+        # из кучи не удаляем: отменённый шаг просто пропускается при извлечении
+        run.cancelled = True
+        self._forget(run)
+
+    def _forget(self, run: _Run) -> None:
+        runs = self._active.get(run.chat_id)
+        if runs and runs.get(run.sequence.name) is run:
+            del runs[run.sequence.name]
+            if not runs:
+                del self._active[run.chat_id]
+
+    def _push(self, run: _Run) -> None:
+        loop = asyncio.get_running_loop()
+        due = loop.time() + run.sequence.steps[run.index].delay
+        heapq.heappush(self._heap, (due, next(self._counter), run))
+        self._wakeup.set()
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            while self._heap:
+                due, _, run = self._heap[0]
+                if due > loop.time():
+                    timeout = due - loop.time()
+                    break
+                heapq.heappop(self._heap)
+                if not run.cancelled:
+                    task = asyncio.create_task(self._execute(run))
+                    self._sending.add(task)
+                    task.add_done_callback(self._sending.discard)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, run: _Run) -> None:
+        step = run.sequence.steps[run.index]
+        try:
+            await send_step(self._bot, run.chat_id, step)
+        except Forbidden:
+            logger.info(f"User {run.chat_id} blocked the bot, sequence {run.sequence.name} stopped")
+            self._cancel_run(run)
+            return
+        except Exception as e:
+            logger.warning(f"Шаг {run.index} последовательности {run.sequence.name} для {run.chat_id} не отправлен: {e}")
+
+        if run.cancelled:
+            return
+        run.index += 1
+        if run.index < len(run.sequence.steps):
+            self._push(run)
+        else:
+            self._forget(run)
+
+
+# Глобальный экземпляр планировщика
+sequence_runner = SequenceRunner()
@@ -0,0 +1,56 @@
+# services/subscription_expiry.py
+from datetime import datetime
+from sqlalchemy import select, update, exists
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, Subscription, SubscriptionStatus
+from services.outbox import add_outbox_message, TELEGRAM_SUBSCRIPTION_ENDED
+
+async def expire_overdue_subscriptions(
+    session: AsyncSession,
+    limit: int = 1000,
+    notify: bool = False,
+) -> tuple[int, int]:
+    """
+    Переводит пачку просроченных активных подписок в expired одним UPDATE
+    (не больше limit строк — блокировки короткие) и возвращает (expired, notified).
+
+    С notify=True в outbox той же транзакцией кладётся сообщение «подписка закончилась» —
+    только тем, у кого не осталось другой действующей подписки.
+    Истёкшие строки выпадают из частичных индексов WHERE status = 'active'.
+    """
+    now = datetime.utcnow()  # end_at хранится без часового пояса, в UTC
+    overdue_ids = (
+        select(Subscription.id)
+        .where(Subscription.status == SubscriptionStatus.active, Subscription.end_at < now)
+        .order_by(Subscription.end_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(Subscription)
+        .where(Subscription.id.in_(overdue_ids))
+        .values(status=SubscriptionStatus.expired)
+        .returning(Subscription.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    user_ids = result.scalars().all()
+    expired = len(user_ids)
+    if not notify or not user_ids:
+        return expired, 0
+
+    still_active = aliased(Subscription)
+    telegram_ids = (await session.scalars(
+        select(User.telegram_id).where(
+            User.id.in_(set(user_ids)),
+            ~exists().where(
+                still_active.user_id == User.id,
+                still_active.status == SubscriptionStatus.active,
+                still_active.end_at >= now,
+            ),
+        )
+    )).all()
+    for telegram_id in telegram_ids:
+        add_outbox_message(session, TELEGRAM_SUBSCRIPTION_ENDED, {"chat_id": telegram_id})
+    return expired, len(telegram_ids)
@@ -1,9 +1,11 @@
 # services/subscriptions.py
 from datetime import datetime, timezone
 from dateutil.relativedelta import relativedelta
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import User, Tariff, Payment, PaymentStatus, Subscription, SubscriptionStatus
+from models import User, Payment, PaymentStatus, Subscription, SubscriptionStatus, PaymentEvent
+from services.tariff_catalog import tariff_catalog
 
 async def get_or_create_user(session: AsyncSession, tg_id: int, username: str | None, first_name: str | None) -> User:
     user = await session.scalar(select(User).where(User.telegram_id == tg_id))
@@ -14,20 +16,93 @@ async def get_or_create_user(session: AsyncSession, tg_id: int, username: str |
     await session.flush()
     return user
 
-async def create_pending_payment(session: AsyncSession, user_id: int, tariff_code: str) -> Payment:
-    tariff = await session.get(Tariff, tariff_code)
-    if not tariff:
-        raise ValueError("Unknown tariff")
-    p = Payment(
-        user_id=user_id,
-        tariff_code=tariff.code,
-        amount_rub=tariff.price_rub,
-        status=PaymentStatus.pending,
-        provider_metadata={},  # <-- было metadata={}
+def _user_upsert(tg_id: int, username: str | None, first_name: str | None):
+    """INSERT ... ON CONFLICT (telegram_id) DO UPDATE ... RETURNING id — всегда возвращает id пользователя"""
+    stmt = pg_insert(User).values(
+        telegram_id=tg_id,
+        username=username,
+        first_name=first_name,
+        created_at=datetime.now(timezone.utc),
+        notification_24h_sent=False,
+        notification_48h_sent=False,
     )
-    session.add(p)
-    await session.flush()  # получим p.id
-    return p
+    return stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={"username": stmt.excluded.username, "first_name": stmt.excluded.first_name},
+    ).returning(User.id)
+
+async def upsert_user(session: AsyncSession, tg_id: int, username: str | None, first_name: str | None) -> int:
+    """Сохраняет или обновляет пользователя за один запрос и возвращает его id"""
+    return await session.scalar(_user_upsert(tg_id, username, first_name))
+
+async def create_payment_intent(
+    session: AsyncSession,
+    tg_id: int,
+    username: str | None,
+    first_name: str | None,
+    tariff_code: str,
+):
+    """
+    Одним запросом: upsert пользователя (CTE) + INSERT pending-платежа по цене тарифа
+    из справочника. Возвращает строку (id, user_id, amount_rub) созданного платежа.
+    """
+    tariff = tariff_catalog.require(tariff_code)
+    user_cte = _user_upsert(tg_id, username, first_name).cte("upserted_user")
+    payments = Payment.__table__
+    stmt = (
+        insert(payments)
+        .from_select(
+            [
+                payments.c.user_id,
+                payments.c.tariff_code,
+                payments.c.amount_rub,
+                payments.c.provider,
+                payments.c.status,
+                payments.c.created_at,
+                payments.c["metadata"],
+            ],
+            select(
+                user_cte.c.id,
+                literal(tariff.code),
+                literal(tariff.price_rub, payments.c.amount_rub.type),
+                literal("yookassa"),
+                literal(PaymentStatus.pending, payments.c.status.type),
+                literal(datetime.now(timezone.utc), payments.c.created_at.type),
+                literal({}, payments.c["metadata"].type),
+            ),
+        )
+        .returning(payments.c.id, payments.c.user_id, payments.c.amount_rub)
+    )
+    return (await session.execute(stmt)).one()
+
+async def set_provider_payment_id(session: AsyncSession, payment_id: int, provider_payment_id: str) -> None:
+    """Точечный UPDATE без повторной загрузки платежа"""
+    await session.execute(
+        update(Payment)
+        .where(Payment.id == payment_id)
+        .values(provider_payment_id=provider_payment_id)
+    )
+
+def payment_event_key(event: str, provider_payment_id: str) -> str:
+    return f"{event}:{provider_payment_id}"
+
+async def record_payment_event(session: AsyncSession, payment_db_id: int, event: str, event_key: str, payload: dict) -> bool:
+    """
+    Записывает событие провайдера. Возвращает False, если событие с таким ключом
+    уже записано (например, параллельная повторная доставка) — тогда его не обрабатываем.
+    """
+    event_id = await session.scalar(
+        pg_insert(PaymentEvent)
+        .values(
+            payments_id=payment_db_id,
+            event=event,
+            event_key=event_key,
+            payload=payload,
+        )
+        .on_conflict_do_nothing(index_elements=[PaymentEvent.event_key])
+        .returning(PaymentEvent.id)
+    )
+    return event_id is not None
 
 async def mark_payment_succeeded(session: AsyncSession, payment_db_id: int, provider_payment_id: str, payload: dict) -> Payment:
     p = await session.get(Payment, payment_db_id)
@@ -35,24 +110,17 @@ async def mark_payment_succeeded(session: AsyncSession, payment_db_id: int, prov
         raise ValueError("Payment not found")
     p.status = PaymentStatus.succeeded
     p.paid_at = datetime.utcnow().replace(tzinfo=timezone.utc)
-    p.provider_payment_id = provider_payment_id
+    if provider_payment_id:
+        # пустую строку не пишем: на provider_payment_id уникальный индекс
+        p.provider_payment_id = provider_payment_id
     p.provider_metadata = payload  # <-- было p.metadata = payload
     await session.flush()
     return p
 
 async def activate_or_extend_subscription(session: AsyncSession, user_id: int, tariff_code: str) -> Subscription:
-    tariff = await session.get(Tariff, tariff_code)
-    if not tariff:
-        raise ValueError("Unknown tariff")
-
-    # Определяем период подписки согласно тарифу
-    if tariff_code == "monthly":
-        months_to_add = 1
-    elif tariff_code == "stable":
-        months_to_add = 3
-    else:
-        # fallback на значение из БД если тариф неизвестный
-        months_to_add = tariff.duration_months
+    # Период подписки берём из справочника тарифов (в памяти, без запроса в БД)
+    tariff = tariff_catalog.require(tariff_code)
+    months_to_add = tariff.duration_months
 
     now = datetime.utcnow().replace(tzinfo=timezone.utc)
     # ищем активную подписку
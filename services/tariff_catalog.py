@@ -0,0 +1,146 @@
+# services/tariff_catalog.py
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import select
+
+from db import engine, get_session
+from models import Tariff
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который триггер на tariffs шлёт NOTIFY при любом изменении
+TARIFFS_CHANNEL = "tariffs_changed"
+
+
+@dataclass(frozen=True)
+class TariffInfo:
+    code: str
+    title: str
+    duration_months: int
+    price_rub: Decimal
+
+    @property
+    def price_text(self) -> str:
+        price = self.price_rub
+        return f"{price:.0f}₽" if price == price.to_integral_value() else f"{price:.2f}₽"
+
+    @property
+    def amount_str(self) -> str:
+        """Сумма в формате ЮKassa, например '1490.00'"""
+        return f"{self.price_rub:.2f}"
+
+    @property
+    def period_text(self) -> str:
+        """'1490₽/мес.' или '3990₽ / 3 мес.'"""
+        if self.duration_months == 1:
+            return f"{self.price_text}/мес."
+        return f"{self.price_text} / {self.duration_months} мес."
+
+    @property
+    def button_label(self) -> str:
+        return f"Тариф {self.title} — {self.period_text}"
+
+    @property
+    def description(self) -> str:
+        """Описание платежа в ЮKassa"""
+        return f"Подписка MARKETSKILLS — {self.title} ({self.duration_months} мес.)"
+
+
+class TariffCatalog:
+    """
+    Справочник тарифов в памяти процесса: загружается при старте,
+    обновляется по TTL и по NOTIFY из БД. Поиск по коду не ходит в БД.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv("TARIFF_CACHE_TTL", "300"))
+        self.listen_enabled = os.getenv("TARIFF_LISTEN", "1") == "1"
+        self._tariffs: dict[str, TariffInfo] = {}
+        # растёт при каждой перезагрузке — по нему зависимые кэши понимают, что пора пересобраться
+        self.version = 0
+        self._changed = asyncio.Event()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._listen_conn = None
+
+    async def load(self) -> None:
+        async with get_session() as session:
+            rows = (await session.scalars(
+                select(Tariff).order_by(Tariff.duration_months, Tariff.code)
+            )).all()
+        self._tariffs = {
+            row.code: TariffInfo(
+                code=row.code,
+                title=row.title,
+                duration_months=row.duration_months,
+                price_rub=Decimal(row.price_rub),
+            )
+            for row in rows
+        }
+        self.version += 1
+        logger.info(f"Загружено тарифов: {len(self._tariffs)}")
+
+    async def start(self) -> None:
+        if self._refresh_task is not None:
+            return  # уже запущен (бот и webhook-сервис в одном процессе)
+        await self.load()
+        if self.listen_enabled:
+            await self._listen()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._listen_conn is not None:
+            await self._listen_conn.close()
+            self._listen_conn = None
+
+    def invalidate(self) -> None:
+        """Просит фоновую задачу перечитать тарифы, не дожидаясь TTL"""
+        self._changed.set()
+
+    def get(self, code: str) -> Optional[TariffInfo]:
+        return self._tariffs.get(code)
+
+    def require(self, code: str) -> TariffInfo:
+        tariff = self._tariffs.get(code)
+        if tariff is None:
+            raise ValueError("Unknown tariff")
+        return tariff
+
+    def all(self) -> list[TariffInfo]:
+        return list(self._tariffs.values())
+
+    async def _listen(self) -> None:
+        try:
+            self._listen_conn = await engine.connect()
+            raw = await self._listen_conn.get_raw_connection()
+            await raw.driver_connection.add_listener(
+                TARIFFS_CHANNEL, lambda *args: self.invalidate()
+            )
+        except Exception as e:
+            logger.warning(f"LISTEN {TARIFFS_CHANNEL} недоступен, обновляем тарифы только по TTL: {e}")
+            if self._listen_conn is not None:
+                await self._listen_conn.close()
+                self._listen_conn = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=self.ttl)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning(f"Не удалось обновить тарифы, оставляем прежние: {e}")
+
+
+# Глобальный экземпляр справочника
+tariff_catalog = TariffCatalog()
@@ -0,0 +1,184 @@
+# services/telegram_rate_limiter.py
+import os
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from services.metrics import TELEGRAM_LATENCY, TELEGRAM_ERRORS, TELEGRAM_RATE_LIMIT_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Полоса исходящего запроса: меньше — раньше получает слот"""
+    TRANSACTIONAL = 0  # оплата прошла, ссылка на оплату, напоминание об оплате
+    INTERACTIVE = 1    # ответы на команды и кнопки (по умолчанию)
+    MARKETING = 2      # 24ч/48ч рассылки
+
+
+class _Gcra:
+    """Generic cell rate algorithm: rate запросов в секунду с разовым всплеском burst"""
+
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0  # theoretical arrival time
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до ближайшего разрешённого запроса"""
+        return max(self.tat, now) - self.tolerance - now
+
+    def take(self, now: float) -> None:
+        self.tat = max(self.tat, now) + self.interval
+
+
+class TelegramRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """
+    Ограничитель исходящих запросов к Bot API (подключается к ExtBot/Application
+    через rate_limiter=, поэтому через него идут все отправки процесса).
+
+    - общий лимит ~30 запросов/с: запросы ждут слот в очереди с приоритетами,
+      транзакционные сообщения обгоняют маркетинговые рассылки;
+    - лимит на чат: ~1 сообщение/с в личке, ~20 в минуту в группе;
+    - RetryAfter от Telegram приостанавливает все отправки процесса на указанное время,
+      после чего запрос повторяется (не больше max_retries раз).
+
+    Приоритет передаётся так: bot.send_message(..., rate_limit_args={"priority": Priority.MARKETING}).
+    Лимиты действуют на процесс: если бот и webhook-сервис шлют одновременно,
+    делите TELEGRAM_GLOBAL_RATE между ними.
+    """
+
+    def __init__(self):
+        self.global_rate = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+        self.private_chat_rate = float(os.getenv("TELEGRAM_PRIVATE_CHAT_RATE", "1"))
+        self.private_chat_burst = int(os.getenv("TELEGRAM_PRIVATE_CHAT_BURST", "3"))
+        self.group_chat_rate = float(os.getenv("TELEGRAM_GROUP_CHAT_RATE", str(20 / 60)))
+        self.max_retries = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+        self._global: Optional[_Gcra] = None
+        self._chats: dict[Union[int, str], _Gcra] = {}
+        # (priority, порядковый номер, future) — ожидающие общего слота
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # до какого момента (loop.time()) Telegram попросил ничего не слать
+        self._paused_until = 0.0
+
+    async def initialize(self) -> None:
+        self._ensure_started()
+
+    async def shutdown(self) -> None:
+        # Один экземпляр может использоваться несколькими ботами процесса:
+        # цикл не останавливаем, его задача умрёт вместе с event loop.
+        pass
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._global = _Gcra(self.global_rate, max(1, int(self.global_rate)))
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch_loop())
+
+    # ---------- общий лимит с приоритетами ----------
+    async def _acquire_global(self, priority: int) -> None:
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            while self._waiters:
+                now = loop.time()
+                wait = max(self._paused_until - now, self._global.delay(now))
+                if wait > 0:
+                    timeout = wait
+                    break
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():  # запрос отменили, пока он ждал
+                    continue
+                self._global.take(now)
+                future.set_result(None)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---------- лимит на чат ----------
+    async def _acquire_chat(self, chat_id: Union[int, str]) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # чаты, чей лимит уже восстановился, хранить незачем
+                self._chats = {k: v for k, v in self._chats.items() if v.tat > now}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = (
+                _Gcra(self.group_chat_rate, 1) if is_group
+                else _Gcra(self.private_chat_rate, self.private_chat_burst)
+            )
+        # слот резервируется сразу, поэтому отправки в один чат идут по очереди
+        wait = bucket.delay(now)
+        bucket.take(now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        priority = (rate_limit_args or {}).get("priority", Priority.INTERACTIVE)
+        priority_label = Priority(priority).name.lower()
+        chat_id = data.get("chat_id")
+        waiting_since = time.perf_counter()
+        # answerCallbackQuery и служебные методы не считаются сообщениями в чат
+        if chat_id is not None and endpoint.startswith(("send", "copy", "forward")):
+            await self._acquire_chat(chat_id)
+
+        attempt = 0
+        while True:
+            await self._acquire_global(priority)
+            started = time.perf_counter()
+            TELEGRAM_RATE_LIMIT_WAIT.observe(started - waiting_since, priority_label)
+            try:
+                return await callback(*args, **kwargs)
+            except Exception as e:
+                TELEGRAM_ERRORS.inc(endpoint, type(e).__name__)
+                if not isinstance(e, RetryAfter):
+                    raise
+                attempt += 1
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(self._paused_until, loop.time() + retry_after + 0.1)
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(
+                    f"Flood control на {endpoint} (chat {chat_id}): пауза {retry_after} с, "
+                    f"попытка {attempt}/{self.max_retries}"
+                )
+                waiting_since = time.perf_counter()
+            finally:
+                TELEGRAM_LATENCY.observe(time.perf_counter() - started, endpoint)
+
+
+# Глобальный экземпляр: один на процесс, общий для бота и webhook-сервиса
+telegram_rate_limiter = TelegramRateLimiter()
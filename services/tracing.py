@@ -0,0 +1,212 @@
+# services/tracing.py
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str], attributes: dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def as_otlp(self) -> dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _is_trace_id(value: Any) -> bool:
+    if not isinstance(value, str) or len(value) != 32:
+        return False
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+    return True
+
+
+# (trace_id, пишется ли трасса, текущий span)
+_current: ContextVar[Optional[tuple[str, bool, Optional[Span]]]] = ContextVar("trace", default=None)
+
+
+class Tracer:
+    """
+    Лёгкая запись span'ов по пути оплаты: клик тарифа -> ЮKassa -> вебхук -> воркер.
+
+    trace_id создаётся на клик, уходит в metadata платежа ЮKassa и возвращается
+    в вебхуке — так шаги разных процессов попадают в одну трассу. Решение о записи
+    принимается по самому trace_id (доля TRACE_SAMPLE_RATE), поэтому бот и
+    webhook-сервис записывают одни и те же трассы без обмена флагами.
+
+    Невыбранная трасса стоит одну проверку в contextvar на шаг. Готовые span'ы
+    копятся в ограниченном буфере и выгружаются фоновой задачей в JSONL-файл
+    (TRACE_EXPORT=jsonl) или в OTLP/HTTP-коллектор (TRACE_EXPORT=otlp).
+    """
+
+    def __init__(self):
+        self.sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+        self.export = os.getenv("TRACE_EXPORT", "")  # "" | jsonl | otlp
+        self.jsonl_path = os.getenv("TRACE_JSONL_PATH", "traces.jsonl")
+        self.otlp_endpoint = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+        self.service_name = os.getenv("TRACE_SERVICE_NAME", "tg-bot")
+        self.flush_interval = float(os.getenv("TRACE_FLUSH_INTERVAL", "5"))
+        self._buffer: deque[Span] = deque(maxlen=int(os.getenv("TRACE_BUFFER_SIZE", "10000")))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.export) and self.sample_rate > 0
+
+    def is_sampled(self, trace_id: str) -> bool:
+        return self.enabled and int(trace_id[:8], 16) < self.sample_rate * 0x100000000
+
+    async def start(self, service_name: Optional[str] = None) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        if service_name and not os.getenv("TRACE_SERVICE_NAME"):
+            self.service_name = service_name
+        if self.export == "otlp":
+            self._client = httpx.AsyncClient(timeout=10.0)
+        self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------- запись ----------
+    def current_trace_id(self) -> Optional[str]:
+        current = _current.get()
+        return current[0] if current else None
+
+    @contextmanager
+    def trace(self, name: str, trace_id: Optional[str] = None, **attributes: Any) -> Iterator[str]:
+        """
+        Корневой шаг трассы. Новый trace_id — на клик; trace_id из metadata платежа —
+        продолжение той же трассы в вебхуке. Возвращает trace_id (correlation id).
+        """
+        if not _is_trace_id(trace_id):
+            trace_id = uuid.uuid4().hex
+        token = _current.set((trace_id, self.is_sampled(trace_id), None))
+        try:
+            with self.span(name, **attributes):
+                yield trace_id
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        current = _current.get()
+        if current is None or not current[1]:
+            yield None
+            return
+        trace_id, _, parent = current
+        span = Span(trace_id, name, parent.span_id if parent else None, attributes)
+        token = _current.set((trace_id, True, span))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"[:500]
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current.reset(token)
+            self._buffer.append(span)
+
+    # ---------- выгрузка ----------
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        spans = [self._buffer.popleft() for _ in range(len(self._buffer))]
+        if not spans:
+            return
+        try:
+            if self.export == "jsonl":
+                await asyncio.to_thread(self._write_jsonl, spans)
+            elif self.export == "otlp":
+                await self._send_otlp(spans)
+        except Exception as e:
+            logger.warning(f"Не удалось выгрузить {len(spans)} span'ов ({self.export}): {e}")
+
+    def _write_jsonl(self, spans: list[Span]) -> None:
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps({"service": self.service_name, **span.as_dict()}, ensure_ascii=False, default=str))
+                f.write("\n")
+
+    async def _send_otlp(self, spans: list[Span]) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.as_otlp() for span in spans]}],
+            }]
+        }
+        response = await self._client.post(self.otlp_endpoint, json=body)
+        response.raise_for_status()
+
+
+# Глобальный экземпляр трассировки
+tracer = Tracer()
@@ -0,0 +1,162 @@
+# services/traffic_capture.py
+import os
+import gzip
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import secrets
+from collections import deque
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Виды записей: обновление Telegram и тела вебхуков FastAPI (по пути маршрута)
+KIND_UPDATE = "update"
+KIND_YOOKASSA = "/yookassa/webhook"
+KIND_N8N = "/n8n/notification"
+
+# Поля с персональными данными: значение заменяется целиком
+_PERSONAL_FIELDS = {
+    "first_name", "last_name", "username", "title", "bio", "phone_number", "email",
+    "payment_method", "receipt_registration",
+}
+# Поля с id пользователя/чата: псевдонимизируются одинаково во всех записях
+_ID_FIELDS = {"chat_id", "telegram_id"}
+_ID_PARENTS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat"}
+# Текст: команды сохраняются (/start, /help), остальное — только длина
+_TEXT_FIELDS = {"text", "caption"}
+
+
+class TrafficRecorder:
+    """
+    Запись входящего трафика для воспроизведения (loadtest/replay.py): обновления
+    Telegram и тела вебхуков ЮKassa/N8N с временем прихода, по строке JSON на событие.
+    Файл только дописывается; путь на .gz — сжатие gzip. Бот и webhook-сервис
+    пишут каждый в свой файл, replay сливает их по времени.
+
+    Включается TRAFFIC_CAPTURE_PATH. Данные обезличиваются до записи: имена и
+    контакты удаляются, текст сообщений заменяется (кроме команд), id пользователей
+    заменяются на HMAC с TRAFFIC_CAPTURE_SALT — один и тот же пользователь
+    в обновлениях и в metadata платежа получает один и тот же псевдоним,
+    поэтому воронка пользователя при воспроизведении не рвётся.
+    """
+
+    def __init__(self):
+        self.path = os.getenv("TRAFFIC_CAPTURE_PATH")
+        # без заданной соли псевдонимы не совпадут между процессами бота и webhook-сервиса
+        self.salt = (os.getenv("TRAFFIC_CAPTURE_SALT") or secrets.token_hex(16)).encode()
+        self.flush_interval = float(os.getenv("TRAFFIC_CAPTURE_FLUSH_INTERVAL", "1"))
+        self._pending: deque[str] = deque(maxlen=int(os.getenv("TRAFFIC_CAPTURE_BUFFER_SIZE", "100000")))
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def active(self) -> bool:
+        """Запись запущена: вызывающий код может не готовить тело события, если нет"""
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            if not os.getenv("TRAFFIC_CAPTURE_SALT"):
+                logger.warning("TRAFFIC_CAPTURE_SALT не задан: псевдонимы id будут разными в разных процессах")
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"Запись трафика в {self.path}")
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+            if self.dropped:
+                logger.warning(f"Запись трафика: потеряно {self.dropped} событий (переполнен буфер)")
+
+    def record(self, kind: str, body: Any) -> None:
+        if self._task is None:
+            return
+        try:
+            line = json.dumps(
+                {"t": round(time.time(), 3), "k": kind, "d": self.anonymize(body)},
+                ensure_ascii=False, separators=(",", ":"),
+            )
+        except Exception as e:
+            logger.debug(f"Событие {kind} не записано: {e}")
+            return
+        if len(self._pending) == self._pending.maxlen:
+            # файл не успевает за потоком: теряем старые события, а не память
+            self.dropped += 1
+        self._pending.append(line)
+
+    # ---------- обезличивание ----------
+    def pseudonym(self, value: Any) -> Any:
+        """Стабильный псевдоним id: десятизначное число, знак сохраняется (группы < 0)"""
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            return value
+        digest = hmac.new(self.salt, str(abs(number)).encode(), hashlib.sha256).hexdigest()
+        alias = 10**9 + int(digest[:12], 16) % (9 * 10**9)
+        alias = -alias if number < 0 else alias
+        return str(alias) if isinstance(value, str) else alias
+
+    def anonymize(self, value: Any, key: Optional[str] = None, parent: Optional[str] = None) -> Any:
+        if isinstance(value, dict):
+            return {k: self._field(k, v, key) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(v, key, parent) for v in value]
+        return value
+
+    def _field(self, key: str, value: Any, parent: Optional[str]) -> Any:
+        if key in _PERSONAL_FIELDS:
+            return None if isinstance(value, dict) else "*"
+        if key in _ID_FIELDS or (key == "id" and parent in _ID_PARENTS):
+            return self.pseudonym(value)
+        if key in _TEXT_FIELDS and isinstance(value, str):
+            return value if value.startswith("/") else "x" * len(value)
+        return self.anonymize(value, key, parent)
+
+    # ---------- запись в файл ----------
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        lines = [self._pending.popleft() for _ in range(len(self._pending))]
+        if not lines:
+            return
+        try:
+            await asyncio.to_thread(self._append, lines)
+        except Exception as e:
+            logger.warning(f"Не удалось записать {len(lines)} событий трафика: {e}")
+
+    def _append(self, lines: list[str]) -> None:
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        if self.path.endswith(".gz"):
+            # каждый сброс — отдельный gzip-member; gzip.open читает их подряд
+            with open(self.path, "ab") as f:
+                f.write(gzip.compress(data))
+        else:
+            with open(self.path, "ab") as f:
+                f.write(data)
+
+
+def read_capture(path: str) -> Iterator[dict]:
+    """События из файла записи в порядке записи"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+# Глобальный экземпляр записи трафика
+traffic_recorder = TrafficRecorder()
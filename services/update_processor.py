@@ -0,0 +1,67 @@
+# services/update_processor.py
+import asyncio
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from services.traffic_capture import traffic_recorder, KIND_UPDATE
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри одного чата.
+
+    Разные чаты обрабатываются одновременно (не больше max_concurrent_updates),
+    а обновления одного чата — строго по очереди: каждое ждёт lock своего чата.
+    Lock берётся ДО общего семафора, поэтому ожидающие обновления одного
+    «шумного» чата не занимают слоты, нужные остальным пользователям.
+    """
+
+    __slots__ = ("_chat_locks",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> [lock, сколько обновлений его держат или ждут]
+        self._chat_locks: dict[int, list] = {}
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # момент получения обновления (до очереди чата) — для воспроизведения всплесков
+        if traffic_recorder.active and isinstance(update, Update):
+            traffic_recorder.record(KIND_UPDATE, update.to_dict())
+
+        key = self._chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                # не держим lock для каждого пользователя, который когда-либо писал боту
+                del self._chat_locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,86 @@
+# services/yookassa_service.py
+import os
+import time
+import logging
+from typing import Optional, Dict, Any
+
+import httpx
+
+from services.metrics import YOOKASSA_LATENCY, YOOKASSA_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class YooKassaError(Exception):
+    """Ошибка обращения к API ЮKassa (сеть, таймаут или ответ не 2xx)"""
+
+
+class YooKassaService:
+    """
+    Асинхронный клиент API ЮKassa поверх одного долгоживущего httpx.AsyncClient.
+    В отличие от SDK yookassa не блокирует event loop на время запроса.
+    """
+
+    def __init__(self):
+        self.shop_id = os.getenv("YOOKASSA_SHOP_ID")
+        self.secret_key = os.getenv("YOOKASSA_SECRET_KEY")
+        self.api_url = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3").rstrip("/")
+        self.timeout = httpx.Timeout(
+            float(os.getenv("YOOKASSA_TIMEOUT", "10")),
+            connect=float(os.getenv("YOOKASSA_CONNECT_TIMEOUT", "5")),
+        )
+        self.limits = httpx.Limits(
+            max_connections=int(os.getenv("YOOKASSA_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("YOOKASSA_MAX_KEEPALIVE", "10")),
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_url,
+                auth=(self.shop_id or "", self.secret_key or ""),
+                timeout=self.timeout,
+                limits=self.limits,
+                headers={"Content-Type": "application/json"},
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, operation: str, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        if self._client is None:
+            await self.start()
+        started = time.perf_counter()
+        try:
+            response = await self._client.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                raise YooKassaError(f"ЮKassa вернула {response.status_code}: {response.text}")
+            return response.json()
+        except httpx.TimeoutException as e:
+            YOOKASSA_ERRORS.inc(operation)
+            raise YooKassaError(f"Timeout при запросе {method} {url}") from e
+        except httpx.HTTPError as e:
+            YOOKASSA_ERRORS.inc(operation)
+            raise YooKassaError(f"Ошибка сети при запросе {method} {url}: {e}") from e
+        except YooKassaError:
+            YOOKASSA_ERRORS.inc(operation)
+            raise
+        finally:
+            YOOKASSA_LATENCY.observe(time.perf_counter() - started, operation)
+
+    async def create_payment(self, payload: Dict[str, Any], idempotence_key: str) -> Dict[str, Any]:
+        """Создаёт платёж (POST /payments) и возвращает объект платежа"""
+        return await self._request(
+            "create_payment", "POST", "/payments", json=payload, headers={"Idempotence-Key": idempotence_key}
+        )
+
+    async def find_payment(self, provider_payment_id: str) -> Dict[str, Any]:
+        """Возвращает объект платежа по его id в ЮKassa"""
+        return await self._request("find_payment", "GET", f"/payments/{provider_payment_id}")
+
+
+# Глобальный экземпляр сервиса
+yookassa_service = YooKassaService()
@@ -5,29 +5,31 @@ from dotenv import load_dotenv
 load_dotenv()  # Загружаем .env файл
 
 import os
+import time
 import logging
-from datetime import datetime
-from pathlib import Path
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
 
 from fastapi import FastAPI, Request, HTTPException
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.constants import ParseMode
-import aiofiles
+from fastapi.responses import Response
+from telegram import Update
+from telegram.ext import ExtBot
 
 from db import get_session
-from subscriptions import (
-    mark_payment_succeeded,
-    activate_or_extend_subscription,
-)
-from models import Payment as PaymentDB, PaymentStatus  # только для типов/отладочных выборок
-from services.notification_service import (
-    get_24h_notification_text,
-    get_24h_notification_keyboard,
-    get_24h_notification_photo_path,
-    get_48h_notification_text,
-    get_48h_notification_keyboard,
-    get_48h_notification_photo_path
-)
+from services.subscriptions import payment_event_key
+from services.payment_worker import payment_worker, enqueue_webhook_event, is_webhook_event_queued
+from services.notification_service import send_followup_notification, notification_templates
+from services.followups import claim_followup, release_followup
+from services.tariff_catalog import tariff_catalog
+from services.telegram_rate_limiter import telegram_rate_limiter
+from services.outbox import outbox_relay
+from services.n8n_service import n8n_service
+from services.reports import REPORTS, REPORTS_TZ, ReportParams
+from services.metrics import metrics, HTTP_LATENCY, CONTENT_TYPE
+from services.tracing import tracer
+from services.traffic_capture import traffic_recorder, KIND_YOOKASSA, KIND_N8N
 
 # ------------------ Config & logging ------------------
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -40,15 +42,99 @@ logging.basicConfig(
 )
 log = logging.getLogger("yookassa-webhook")
 
-bot = Bot(token=BOT_TOKEN)
-app = FastAPI(title="YooKassa Webhook")
+# Все отправки идут через общий ограничитель (лимиты Telegram, приоритеты, RetryAfter)
+bot = ExtBot(
+    token=BOT_TOKEN,
+    base_url=os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot"),
+    rate_limiter=telegram_rate_limiter,
+)
+
+# ------------------ Telegram updates (webhook mode) ------------------
+# Если задан TELEGRAM_WEBHOOK_URL, бот (Application из main.py) принимает обновления
+# через этот же FastAPI-сервис вместо polling. Процессов может быть несколько.
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")  # https://host/telegram/webhook
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# setWebhook достаточно вызвать из одного экземпляра
+TELEGRAM_SET_WEBHOOK = os.getenv("TELEGRAM_SET_WEBHOOK", "1") == "1"
+
+# Если задан, /metrics требует заголовок Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Отчёты для дашбордов и n8n (GET /reports/{name}); без токена endpoint выключен
+REPORTS_TOKEN = os.getenv("REPORTS_TOKEN")
+
+telegram_app = None
+if TELEGRAM_WEBHOOK_URL:
+    from main import build_application, ALLOWED_UPDATES
+    telegram_app = build_application()
+
+
+async def start_telegram_app() -> None:
+    await telegram_app.initialize()
+    if telegram_app.post_init:
+        await telegram_app.post_init(telegram_app)
+    if TELEGRAM_SET_WEBHOOK:
+        await telegram_app.bot.set_webhook(
+            url=TELEGRAM_WEBHOOK_URL,
+            allowed_updates=ALLOWED_UPDATES,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+        )
+        log.info(f"Telegram webhook set to {TELEGRAM_WEBHOOK_URL}")
+    await telegram_app.start()
+
+
+async def stop_telegram_app() -> None:
+    await telegram_app.stop()
+    await telegram_app.shutdown()
+    if telegram_app.post_shutdown:
+        await telegram_app.post_shutdown(telegram_app)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Справочник тарифов нужен activate_or_extend_subscription без запроса в БД
+    await tariff_catalog.start()
+    # Битый шаблон уведомления должен ронять старт, а не рассылку
+    notification_templates.load()
+    await n8n_service.start()
+    await outbox_relay.start(bot)
+    await tracer.start("yookassa-webhook")
+    await traffic_recorder.start()
+    await payment_worker.start()
+    if telegram_app:
+        await start_telegram_app()
+    try:
+        yield
+    finally:
+        if telegram_app:
+            await stop_telegram_app()
+        await payment_worker.close()
+        await traffic_recorder.close()
+        await tracer.close()
+        await outbox_relay.close()
+        await n8n_service.close()
+        await tariff_catalog.close()
+
 
-# ------------------ Helpers ------------------
-def fmt_dt(dt: datetime | None) -> str:
-    if not dt:
-        return "—"
-    # показываем в UTC; при желании добавь tz/локаль
-    return dt.strftime("%Y-%m-%d %H:%M UTC")
+app = FastAPI(title="YooKassa Webhook", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def observe_request_time(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # метка — шаблон маршрута (/reports/{name}), а не фактический путь
+        route = request.scope.get("route")
+        HTTP_LATENCY.observe(
+            time.perf_counter() - started,
+            route.path if route is not None else "unmatched",
+            str(status),
+        )
 
 
 # ------------------ Routes ------------------
@@ -56,6 +142,30 @@ def fmt_dt(dt: datetime | None) -> str:
 async def healthz():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Метрики процесса в формате Prometheus"""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    """Принимает обновления от Telegram и кладёт их в очередь Application"""
+    if telegram_app is None:
+        raise HTTPException(status_code=404, detail="Telegram webhook mode is disabled")
+
+    if TELEGRAM_WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+
+    try:
+        data = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+
+    await telegram_app.update_queue.put(Update.de_json(data, telegram_app.bot))
+    return {"status": "ok"}
+
 @app.post("/yookassa/webhook")
 async def yookassa_webhook(request: Request):
     """
@@ -67,107 +177,58 @@ async def yookassa_webhook(request: Request):
         data = await request.json()
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
+    traffic_recorder.record(KIND_YOOKASSA, data)
 
     event = data.get("event")
     obj = data.get("object") or {}
     provider_payment_id = obj.get("id")
 
-    # metadata, который мы передавали при создании платежа
+    # metadata, который мы передавали при создании платежа; trace_id связывает
+    # этот запрос с кликом по тарифу в боте и с обработкой в payment_worker
     md = obj.get("metadata") or {}
-    payment_db_id = md.get("payment_db_id")
-    chat_id = md.get("chat_id")
-    tariff = md.get("tariff")
-
-    log.info(
-        f"[YK] event={event} provider_payment_id={provider_payment_id} "
-        f"payment_db_id={payment_db_id} chat_id={chat_id} tariff={tariff}"
-    )
-
-    # Обрабатываем только успешную оплату
-    if event != "payment.succeeded":
-        return {"status": "ignored"}
-
-    if payment_db_id is None:
-        # Без нашего внутреннего ID не знаем, какой платеж апдейтить
-        log.error("Missing metadata.payment_db_id in webhook payload")
-        raise HTTPException(status_code=400, detail="Missing payment_db_id")
-
-    async with get_session() as session:
+    with tracer.trace("yookassa_webhook", trace_id=md.get("trace_id"), event=str(event)):
+        payment_db_id = md.get("payment_db_id")
+        chat_id = md.get("chat_id")
+        tariff = md.get("tariff")
+
+        log.info(
+            f"[YK] event={event} provider_payment_id={provider_payment_id} "
+            f"payment_db_id={payment_db_id} chat_id={chat_id} tariff={tariff}"
+        )
+
+        # Обрабатываем только успешную оплату
+        if event != "payment.succeeded":
+            return {"status": "ignored"}
+
+        if payment_db_id is None:
+            # Без нашего внутреннего ID не знаем, какой платеж апдейтить
+            log.error("Missing metadata.payment_db_id in webhook payload")
+            raise HTTPException(status_code=400, detail="Missing payment_db_id")
+
+        event_key = payment_event_key(event, provider_payment_id or str(payment_db_id))
+
+        # Только сохраняем событие и сразу отвечаем: платёж, подписку и сообщение
+        # в Telegram обрабатывает payment_worker. Повторная доставка ЮKassa — дубль по event_key:
+        # её отсекает чтение по уникальному индексу, без транзакции на запись;
+        # ON CONFLICT в enqueue_webhook_event страхует от параллельных доставок.
         try:
-            # 1) Обновляем запись платежа: succeeded + paid_at + provider_payment_id + сырой payload
-            payment: PaymentDB = await mark_payment_succeeded(
-                session=session,
-                payment_db_id=int(payment_db_id),
-                provider_payment_id=provider_payment_id or "",
-                payload=obj,
-            )
-
-            # 2) Активируем/продлеваем подписку пользователю по тарифу из платежа
-            sub = await activate_or_extend_subscription(
-                session=session,
-                user_id=payment.user_id,
-                tariff_code=payment.tariff_code,
-            )
-
-            await session.commit()
-            log.info(
-                f"Payment {payment.id} marked as succeeded; "
-                f"subscription end_at={fmt_dt(sub.end_at)} user_id={payment.user_id}"
-            )
+            with tracer.span("webhook_inbox.enqueue"):
+                async with get_session() as session:
+                    if await is_webhook_event_queued(session, event_key):
+                        queued = False
+                    else:
+                        queued = await enqueue_webhook_event(session, event_key=event_key, event=event, payload=obj)
+                        await session.commit()
         except Exception as e:
-            log.exception("Failed to handle payment.succeeded")
-            await session.rollback()
-            raise HTTPException(status_code=500, detail="processing_error") from e
+            log.exception("Failed to enqueue payment.succeeded")
+            raise HTTPException(status_code=500, detail="enqueue_error") from e
 
-    # 3) Уведомляем пользователя в Telegram (если chat_id передали в metadata)
-    if chat_id:
-        try:
-            text = """Оплата прошла успешно!
-
-Добро пожаловать в МаркетСкиллс. Закреп этого бота чтобы не потерять, здесь будут лучшие предложения для участие в клубе. Подключайся👇🏻"""
-
-            keyboard = [[InlineKeyboardButton("Подключиться", url="https://t.me/+894eFO0WhbhjZTUy")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            # Используем абсолютный путь к файлу
-            photo_path = Path(__file__).parent / "content" / "photo4.jpg"
-
-            try:
-                # Проверяем существование файла
-                if not photo_path.exists():
-                    log.error(f"Файл не найден: {photo_path}")
-                    raise FileNotFoundError(f"Photo file not found: {photo_path}")
-                
-                # Асинхронное чтение файла
-                async with aiofiles.open(photo_path, 'rb') as photo:
-                    photo_data = await photo.read()
-                    await bot.send_photo(
-                        chat_id=int(chat_id),
-                        photo=photo_data,
-                        caption=text,
-                        reply_markup=reply_markup
-                    )
-                log.info(f"Успешно отправлено фото пользователю {chat_id}")
-            except FileNotFoundError as e:
-                log.error(f"Файл не найден: {e}")
-                await bot.send_message(
-                    chat_id=int(chat_id),
-                    text=text,
-                    reply_markup=reply_markup
-                )
-                log.info(f"Отправлено текстовое сообщение пользователю {chat_id} (без фото)")
-            except Exception as e:
-                log.error(f"Ошибка при отправке фото пользователю {chat_id}: {e}")
-                await bot.send_message(
-                    chat_id=int(chat_id),
-                    text=text,
-                    reply_markup=reply_markup
-                )
-                log.info(f"Отправлено текстовое сообщение пользователю {chat_id} (fallback)")
-        except Exception as e:
-            log.exception(f"Критическая ошибка при отправке уведомления пользователю {chat_id}: {e}")
+        if not queued:
+            log.info(f"[YK] duplicate event {event_key}, skipping")
+            return {"status": "duplicate"}
 
-    return {"status": "ok"}
+        payment_worker.notify()
+        return {"status": "accepted"}
 
 @app.post("/n8n/notification")
 async def n8n_notification_webhook(request: Request):
@@ -178,6 +239,7 @@ async def n8n_notification_webhook(request: Request):
         data = await request.json()
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
+    traffic_recorder.record(KIND_N8N, data)
 
     # Получаем данные из N8N
     user_id = data.get("user_id")
@@ -197,92 +259,64 @@ async def n8n_notification_webhook(request: Request):
         log.error(f"Invalid notification_type: {notification_type}")
         raise HTTPException(status_code=400, detail="Invalid notification_type")
 
+    # Сначала флаг, потом сообщение: если запись в БД не пройдёт, пользователь не получит
+    # сообщение дважды при повторе N8N, а встроенный движок follow-up его уже не отправит
+    try:
+        async with get_session() as session:
+            claimed = await claim_followup(session, int(user_id), notification_type)
+            await session.commit()
+    except Exception as e:
+        log.exception(f"Failed to mark {notification_type} notification for user {user_id}")
+        raise HTTPException(status_code=500, detail="db_error") from e
+
+    if not claimed:
+        log.info(f"[N8N] {notification_type} notification for user {user_id} already sent, skipping")
+        return {"status": "duplicate"}
+
     # Отправляем соответствующее уведомление
     try:
         log.info(f"Starting to send {notification_type} notification to {telegram_id}")
-        
-        if notification_type == "24h":
-            # 24-часовое уведомление
-            text = get_24h_notification_text()
-            keyboard = get_24h_notification_keyboard()
-            photo_path = Path(__file__).parent / "content" / "p24.jpg"
-            
-            # Отправляем фото с текстом и кнопкой
-            log.info(f"Photo path for 24h: {photo_path}, exists: {photo_path.exists()}")
-            try:
-                if photo_path.exists():
-                    async with aiofiles.open(photo_path, 'rb') as photo:
-                        photo_data = await photo.read()
-                        await bot.send_photo(
-                            chat_id=int(telegram_id),
-                            photo=photo_data,
-                            caption=text,
-                            parse_mode=ParseMode.HTML,
-                            reply_markup=keyboard
-                        )
-                else:
-                    log.warning(f"Photo not found: {photo_path}, sending text only")
-                    await bot.send_message(
-                        chat_id=int(telegram_id),
-                        text=text,
-                        parse_mode=ParseMode.HTML,
-                        reply_markup=keyboard
-                    )
-            except Exception as e:
-                log.error(f"Error sending photo, fallback to text: {e}")
-                await bot.send_message(
-                    chat_id=int(telegram_id),
-                    text=text,
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=keyboard
-                )
-            
-            log.info(f"Sent 24h notification to user {telegram_id}")
-            
-        elif notification_type == "48h":
-            # 48-часовое уведомление
-            text = get_48h_notification_text()
-            keyboard = get_48h_notification_keyboard()
-            photo_path = Path(__file__).parent / "content" / "p48.jpg"
-            
-            # Отправляем фото с текстом и кнопкой
-            log.info(f"Photo path for 48h: {photo_path}, exists: {photo_path.exists()}")
-            try:
-                if photo_path.exists():
-                    async with aiofiles.open(photo_path, 'rb') as photo:
-                        photo_data = await photo.read()
-                        await bot.send_photo(
-                            chat_id=int(telegram_id),
-                            photo=photo_data,
-                            caption=text,
-                            parse_mode=ParseMode.HTML,
-                            reply_markup=keyboard
-                        )
-                else:
-                    log.warning(f"Photo not found: {photo_path}, sending text only")
-                    await bot.send_message(
-                        chat_id=int(telegram_id),
-                        text=text,
-                        parse_mode=ParseMode.HTML,
-                        reply_markup=keyboard
-                    )
-            except Exception as e:
-                log.error(f"Error sending photo, fallback to text: {e}")
-                await bot.send_message(
-                    chat_id=int(telegram_id),
-                    text=text,
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=keyboard
-                )
-            
-            log.info(f"Sent 48h notification to user {telegram_id}")
-            
+        await send_followup_notification(bot, int(telegram_id), notification_type)
+        log.info(f"Sent {notification_type} notification to user {telegram_id}")
+
     except Exception as e:
         if "blocked by the user" in str(e):
             log.warning(f"User {telegram_id} blocked the bot, skipping notification")
             return {"status": "skipped", "reason": "user_blocked_bot"}
-        else:
-            log.exception(f"Failed to send notification to user {telegram_id}: {e}")
-            raise HTTPException(status_code=500, detail="telegram_send_error")
+
+        log.exception(f"Failed to send notification to user {telegram_id}: {e}")
+        # снимаем флаг, чтобы повтор N8N отправил сообщение
+        try:
+            async with get_session() as session:
+                await release_followup(session, int(user_id), notification_type)
+                await session.commit()
+        except Exception:
+            log.exception(f"Failed to release {notification_type} notification flag for user {user_id}")
+        raise HTTPException(status_code=500, detail="telegram_send_error")
 
     return {"status": "ok", "notification_type": notification_type}
+
+
+@app.get("/reports/{name}")
+async def report(
+    name: str,
+    request: Request,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    rollup: bool = True,
+):
+    """
+    Отчёт из services/reports.py в JSON. По умолчанию — последние 7 дней и дневные
+    агрегаты из daily_payment_stats, чтобы частый опрос не сканировал payments.
+    Токен передаётся в заголовке X-Reports-Token.
+    """
+    if not REPORTS_TOKEN or name not in REPORTS:
+        raise HTTPException(status_code=404, detail="Not found")
+    if request.headers.get("X-Reports-Token") != REPORTS_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    until = until or datetime.now(ZoneInfo(REPORTS_TZ)).date() + timedelta(days=1)
+    params = ReportParams(since=since or until - timedelta(days=7), until=until, from_rollup=rollup)
+    async with get_session() as session:
+        result = await REPORTS[name](session, params)
+    return {"report": name, "since": params.since, "until": params.until, "rows": result.as_dicts()}